@@ -16,13 +16,202 @@ sys.path.insert(0, "../src/")
 import csv
 from collections import defaultdict
 from tkinter import Tk, Label, Button, Message, OptionMenu, StringVar, END, \
-        ttk, Entry, IntVar, END, W, E, Radiobutton
+        ttk, Entry, IntVar, END, W, E, N, S, Radiobutton, Toplevel, Frame
+import numpy as np
+import pandas as pd
 from cars_com_crawling import craw_from_url
 from handle_search_carscom import generate_url
 from utility import user_input, write_cars_to_csv, extract_info_from_csvfilename
 from data_analysis import load_csvfile, analyze_price, print_price_info, plot_price_info
 
 
+class ListingIndex:
+    """sort and range filter listings with presorted index arrays"""
+
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self.orders = {}
+        self.sort_column = None
+        self.ascending = True
+        self.ranges = {}
+        self.rows = np.arange(len(self.df))
+
+    def order(self, column):
+        """row indices sorted by column, computed once per column"""
+        if column not in self.orders:
+            values = self.df[column]
+            if pd.api.types.is_numeric_dtype(values):
+                # argsort puts NaN last
+                keys = values.values
+            else:
+                # sort text by rank of its sorted categories, missing
+                # values have code -1 and are moved last like NaN
+                codes = pd.factorize(values.astype(object).values, sort=True)[0]
+                keys = np.where(codes < 0, np.iinfo(np.int32).max, codes)
+            self.orders[column] = np.argsort(keys, kind='stable')
+        return self.orders[column]
+
+    def set_sort(self, column, ascending=True):
+        self.sort_column = column
+        self.ascending = ascending
+        self.update()
+
+    def set_range(self, column, low=None, high=None, refresh=True):
+        """keep rows with low <= value <= high, None means no bound"""
+        if low is None and high is None:
+            self.ranges.pop(column, None)
+        else:
+            self.ranges[column] = (low, high)
+        if refresh:
+            self.update()
+
+    def update(self):
+        """recompute visible rows without sorting the Data Frame"""
+        n = len(self.df)
+        keep = np.ones(n, dtype=bool)
+        for column, (low, high) in self.ranges.items():
+            order = self.order(column)
+            values = self.df[column].values[order]
+            # NaN are sorted last and never kept
+            num_valid = n - int(np.isnan(values).sum())
+            lo = 0 if low is None else np.searchsorted(values[:num_valid], low, 'left')
+            hi = num_valid if high is None else np.searchsorted(values[:num_valid], high, 'right')
+            mask = np.zeros(n, dtype=bool)
+            mask[order[lo:hi]] = True
+            keep &= mask
+        if self.sort_column is None:
+            rows = np.arange(n)
+        else:
+            rows = self.order(self.sort_column)
+            if not self.ascending:
+                # NaN stay last in both directions
+                values = self.df[self.sort_column].values
+                num_valid = n - int(pd.isnull(values).sum())
+                rows = np.r_[rows[:num_valid][::-1], rows[num_valid:]]
+        self.rows = rows[keep[rows]]
+
+
+class ResultsView:
+    """virtualized table of listings, only visible rows are rendered"""
+    columns = ['name', 'price', 'miles', 'distance', 'color', 'seller_name']
+    range_columns = ['price', 'miles', 'distance']
+
+    def __init__(self, master, df, height=25):
+        self.top = Toplevel(master)
+        self.top.title("Listings")
+        df = df.copy()
+        distance = [item for item in df.columns if item.startswith('distance_from')]
+        df['distance'] = df[distance[0]] if distance else np.nan
+        for column in self.range_columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+        self.df = df[self.columns]
+        self.values = self.df.values
+        self.index = ListingIndex(self.df)
+        self.height = height
+        self.offset = 0
+        self.error = ''
+        # 1. range filters
+        filter_frame = Frame(self.top)
+        self.range_entries = {}
+        for i, column in enumerate(self.range_columns):
+            Label(filter_frame, text="{} from".format(column)).grid(row=0, column=4 * i)
+            low = Entry(filter_frame, width=8)
+            high = Entry(filter_frame, width=8)
+            low.grid(row=0, column=4 * i + 1)
+            Label(filter_frame, text="to").grid(row=0, column=4 * i + 2)
+            high.grid(row=0, column=4 * i + 3)
+            self.range_entries[column] = (low, high)
+        Button(filter_frame, text="Filter", command=self.apply_filters).grid(
+            row=0, column=4 * len(self.range_columns))
+        self.count_text = StringVar()
+        Label(filter_frame, textvariable=self.count_text).grid(
+            row=0, column=4 * len(self.range_columns) + 1)
+        # 2. table with a fixed number of items
+        self.tree = ttk.Treeview(self.top, columns=self.columns, show='headings',
+                                 height=height)
+        for column in self.columns:
+            self.tree.heading(column, text=column,
+                              command=lambda c=column: self.sort(c))
+            self.tree.column(column, width=300 if column == 'name' else 100)
+        self.items = [self.tree.insert('', END, values=()) for _ in range(height)]
+        self.scrollbar = ttk.Scrollbar(self.top, orient='vertical',
+                                       command=self.scroll)
+        self.tree.bind('<MouseWheel>', self.on_wheel)
+        self.tree.bind('<Button-4>', lambda event: self.move(-3))
+        self.tree.bind('<Button-5>', lambda event: self.move(3))
+        # 3. layout
+        filter_frame.grid(row=0, column=0, columnspan=2, sticky=W)
+        self.tree.grid(row=1, column=0, sticky=N + S + E + W)
+        self.scrollbar.grid(row=1, column=1, sticky=N + S)
+        self.render()
+
+    def render(self):
+        """fill the fixed items with rows at current offset"""
+        rows = self.index.rows
+        num_rows = len(rows)
+        self.offset = max(0, min(self.offset, num_rows - self.height))
+        visible = rows[self.offset:self.offset + self.height]
+        values = self.values[visible]
+        for i, item in enumerate(self.items):
+            if i < len(visible):
+                self.tree.item(item, values=[self.format(v) for v in values[i]])
+            else:
+                self.tree.item(item, values=())
+        if num_rows:
+            self.scrollbar.set(self.offset / num_rows,
+                               min(1.0, (self.offset + self.height) / num_rows))
+        else:
+            self.scrollbar.set(0, 1)
+        self.count_text.set("{:,d} of {:,d} cars{}".format(
+            num_rows, len(self.df), self.error))
+
+    @staticmethod
+    def format(value):
+        if isinstance(value, float):
+            return '' if np.isnan(value) else "{:,.0f}".format(value)
+        return value
+
+    def move(self, num_rows):
+        self.offset += num_rows
+        self.render()
+
+    def scroll(self, action, amount, unit=None):
+        """scrollbar command"""
+        if action == 'moveto':
+            self.offset = int(float(amount) * len(self.index.rows))
+            self.render()
+        elif unit == 'pages':
+            self.move(int(amount) * self.height)
+        else:
+            self.move(int(amount))
+
+    def on_wheel(self, event):
+        self.move(-3 if event.delta > 0 else 3)
+
+    def sort(self, column):
+        """sort by column, click again to reverse"""
+        ascending = not (self.index.sort_column == column and self.index.ascending)
+        self.index.set_sort(column, ascending)
+        self.offset = 0
+        self.render()
+
+    def apply_filters(self):
+        """set range filters, a column with bad input keeps its old range"""
+        bad = []
+        for column, (low, high) in self.range_entries.items():
+            try:
+                low_value = float(low.get()) if low.get().strip() else None
+                high_value = float(high.get()) if high.get().strip() else None
+            except ValueError:
+                bad.append(column)
+                continue
+            self.index.set_range(column, low_value, high_value, refresh=False)
+        self.error = " (bad {} range)".format(', '.join(bad)) if bad else ''
+        self.index.update()
+        self.offset = 0
+        self.render()
+
+
 class SearchGUI:
     def __init__(self, master):
         self.master = master
@@ -91,6 +280,8 @@ class SearchGUI:
         self.max_label = Label(master, textvariable=self.max_label_text)
         self.max_name_label = Label(master, text="Max Price ($): ")
 
+        self.df = None
+        self.listings_button = Button(master, text="Listings", command=self.show_listings)
         self.search_button = Button(master, text="Search", command=self.search)
         self.close_button = Button(master, text="Close", command=master.quit)
         # self.close_button.pack()
@@ -112,6 +303,7 @@ class SearchGUI:
         self.mean_label.grid(row=6, column=1, columnspan=2, sticky=W+E)
         self.max_name_label.grid(row=7, column=0, sticky=W)
         self.max_label.grid(row=7, column=1, columnspan=2, sticky=W+E)
+        self.listings_button.grid(row=8, column=0)
         self.search_button.grid(row=8, column=1)
         self.close_button.grid(row=8, column=2)
 
@@ -133,6 +325,7 @@ class SearchGUI:
         craw_from_url(start_url, csv_name)
         print("finish crawling...")
         df = load_csvfile(csv_name)
+        self.df = df
         car_info = extract_info_from_csvfilename(csv_name)
         price_info = analyze_price(df)
         # print_price_info(price_info, car_info)
@@ -144,6 +337,12 @@ class SearchGUI:
         self.max_label_text.set(self.max)
 
 
+    def show_listings(self):
+        """show crawled listings of last search in a table"""
+        if self.df is not None:
+            ResultsView(self.master, self.df)
+
+
     def validate(self, new_text):
         """check whether the input zip code is valid or not"""
         if not new_text:
@@ -0,0 +1,10 @@
+#!/bin/bash
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+# re-parse raw pages archived in
+# data/archive with current parser
+##################################
+
+python src/reparse_test.py data/archive data/reparsed.csv
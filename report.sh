@@ -0,0 +1,10 @@
+#!/bin/bash
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+# render price comparison charts of
+# all csv files in data/ to report/
+##################################
+
+python src/price_report.py data/ report/ src/cars_com_make_model.json png maker
@@ -0,0 +1,10 @@
+#!/bin/bash
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+# start local crawl service, use it with
+# export CARSCOM_SERVICE=http://127.0.0.1:8765
+##################################
+
+python src/crawl_service.py src/cars_com_make_model.json 8765 900
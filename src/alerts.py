@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module matches new and changed listings of a crawl against
+saved searches and writes the matches to a notification log
+
+Saved searches are hashed by maker/model, inside a bucket every
+search is put in the interval tree of its first range (price,
+miles or distance). A listing is matched by a stabbing query on
+every tree of its buckets, only the searches found are checked
+against their other ranges. Listings are compared with the
+previous crawl, so only the delta is matched.
+"""
+
+# standard library
+import os
+import sys
+import json
+import time
+
+# third party library
+import numpy as np
+import pandas as pd
+
+# local library
+from utility import parse_csv_name
+from handle_search_carscom import load_car_catalog
+from data_analysis import load_csvfile
+
+ANY = '*'
+# ranges of a saved search, the first one given is indexed
+RANGE_KEYS = ('price', 'miles', 'distance')
+
+
+class IntervalTree:
+    """static centered interval tree of closed intervals"""
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals: list of (low, high, item)
+        """
+        self.root = self._build(list(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        ends = sorted(value for low, high, _ in intervals for value in (low, high))
+        center = ends[len(ends) // 2]
+        left = [item for item in intervals if item[1] < center]
+        right = [item for item in intervals if item[0] > center]
+        here = [item for item in intervals if item[0] <= center <= item[1]]
+        # (center, sorted by low, sorted by high descending, left, right)
+        return (center,
+                sorted(here, key=lambda item: item[0]),
+                sorted(here, key=lambda item: -item[1]),
+                self._build(left), self._build(right))
+
+    def stab(self, value):
+        """
+        items of all intervals containing value
+
+        Args:
+            value: number
+
+        Returns:
+            list of items
+        """
+        result = []
+        node = self.root
+        while node is not None:
+            center, by_low, by_high, left, right = node
+            if value < center:
+                for low, _, item in by_low:
+                    if low > value:
+                        break
+                    result.append(item)
+                node = left
+            elif value > center:
+                for _, high, item in by_high:
+                    if high < value:
+                        break
+                    result.append(item)
+                node = right
+            else:
+                result.extend(item for _, _, item in by_low)
+                break
+        return result
+
+
+def parse_subscription(item):
+    """
+    check one saved search
+
+    Args:
+        item: dictionary, e.g. {"id": "q3-deal", "maker": "Audi", "model": "Q3",
+              "condition": "used", "price": [20000, 30000], "miles": [0, 40000]}
+
+    Returns:
+        (subscription, error): subscription with upper case maker/model/condition
+        and (low, high) ranges, or None and an error message
+    """
+    if not isinstance(item, dict) or not isinstance(item.get('id'), str):
+        return None, "saved search without id: {}".format(item)
+    unknown = set(item) - {'id', 'maker', 'model', 'condition'} - set(RANGE_KEYS)
+    if unknown:
+        return None, "{}: unknown key(s) {}".format(item['id'], ', '.join(sorted(unknown)))
+    subscription = {'id': item['id']}
+    for key in ('maker', 'model', 'condition'):
+        subscription[key] = str(item.get(key, ANY)).upper()
+    for key in RANGE_KEYS:
+        if key not in item:
+            continue
+        value = item[key]
+        if not (isinstance(value, list) and len(value) == 2 and
+                all(isinstance(bound, (int, float)) for bound in value) and
+                value[0] <= value[1]):
+            return None, "{}: {} must be [low, high]".format(item['id'], key)
+        subscription[key] = (value[0], value[1])
+    return subscription, None
+
+
+def load_subscriptions(subscription_file):
+    """
+    load saved searches from a json list
+
+    Args:
+        subscription_file: json filename
+
+    Returns:
+        (subscriptions, errors)
+    """
+    with open(subscription_file, 'r') as f:
+        items = json.load(f)
+    subscriptions = []
+    errors = []
+    ids = set()
+    for item in items:
+        subscription, error = parse_subscription(item)
+        if error is None and subscription['id'] in ids:
+            error = "duplicate saved search {}".format(subscription['id'])
+        if error is not None:
+            errors.append(error)
+            continue
+        ids.add(subscription['id'])
+        subscriptions.append(subscription)
+    return subscriptions, errors
+
+
+class SubscriptionIndex:
+    """saved searches indexed by maker/model and by their first range"""
+
+    def __init__(self, subscriptions):
+        """
+        Args:
+            subscriptions: list from load_subscriptions()
+        """
+        self.subscriptions = subscriptions
+        buckets = {}
+        for i, subscription in enumerate(subscriptions):
+            bucket = buckets.setdefault(
+                (subscription['maker'], subscription['model']),
+                {key: [] for key in RANGE_KEYS + (ANY,)})
+            key = next((key for key in RANGE_KEYS if key in subscription), ANY)
+            low, high = subscription.get(key, (None, None))
+            bucket[key].append((low, high, i))
+        # (tree of each range, searches without range) per maker/model
+        self.buckets = {}
+        for bucket_key, bucket in buckets.items():
+            trees = {key: IntervalTree(bucket[key]) for key in RANGE_KEYS if bucket[key]}
+            self.buckets[bucket_key] = (trees, [i for _, _, i in bucket[ANY]])
+
+    def match(self, listing):
+        """
+        saved searches matching a listing
+
+        Args:
+            listing: dictionary with maker, model, condition and
+                     price, miles, distance (NaN if unknown)
+
+        Returns:
+            list of subscriptions
+        """
+        maker, model = listing['maker'], listing['model']
+        result = []
+        for bucket_key in ((maker, model), (maker, ANY), (ANY, model), (ANY, ANY)):
+            if bucket_key not in self.buckets:
+                continue
+            trees, unindexed = self.buckets[bucket_key]
+            candidates = list(unindexed)
+            for key, tree in trees.items():
+                if not np.isnan(listing[key]):
+                    candidates.extend(tree.stab(listing[key]))
+            for i in candidates:
+                subscription = self.subscriptions[i]
+                if self._check(subscription, listing):
+                    result.append(subscription)
+        return result
+
+    @staticmethod
+    def _check(subscription, listing):
+        if subscription['condition'] not in (ANY, listing['condition']):
+            return False
+        for key in RANGE_KEYS:
+            if key in subscription:
+                low, high = subscription[key]
+                # NaN fails both comparisons
+                if not low <= listing[key] <= high:
+                    return False
+        return True
+
+
+def listing_keys(df):
+    """
+    identity of listings across crawls: VIN, or name, seller and
+    miles if VIN is missing
+
+    Args:
+        df: Data Frame crawled from cars.com
+
+    Returns:
+        numpy array of strings
+    """
+    vin = df['VIN'].fillna('').astype(str).str.strip() if 'VIN' in df.columns \
+        else pd.Series('', index=df.index)
+    fallback = (df['name'].astype(str) + '|' + df['seller_name'].astype(str) + '|' +
+                df['miles'].astype(str))
+    return np.where(vin != '', vin, fallback)
+
+
+def listing_values(df):
+    """
+    price, miles and distance columns as floats
+
+    Args:
+        df: Data Frame crawled from cars.com
+
+    Returns:
+        dictionary key -> numpy array
+    """
+    distance_col = [item for item in df.columns if item.startswith('distance_from')]
+    columns = {'price': 'price', 'miles': 'miles',
+               'distance': distance_col[0] if distance_col else None}
+    values = {}
+    for key, column in columns.items():
+        if column is None:
+            values[key] = np.full(len(df), np.nan)
+        else:
+            values[key] = pd.to_numeric(df[column], errors='coerce').values.astype(float)
+    return values
+
+
+class AlertStore:
+    """saved searches, listings seen so far and the notification log"""
+
+    def __init__(self, alert_dir):
+        """
+        Args:
+            alert_dir: directory with subscriptions.json, created files are
+                       seen.json (last price of every listing) and
+                       notifications.jsonl
+        """
+        self.alert_dir = alert_dir
+        subscription_file = os.path.join(alert_dir, 'subscriptions.json')
+        if not os.path.exists(subscription_file):
+            print("{} does not exist".format(subscription_file))
+            sys.exit(1)
+        subscriptions, errors = load_subscriptions(subscription_file)
+        if errors:
+            print("{:d} error(s) in {}:".format(len(errors), subscription_file))
+            for error in errors:
+                print("  " + error)
+            sys.exit(1)
+        self.index = SubscriptionIndex(subscriptions)
+        self.seen_file = os.path.join(alert_dir, 'seen.json')
+        self.seen = {}
+        if os.path.exists(self.seen_file):
+            with open(self.seen_file, 'r') as f:
+                self.seen = json.load(f)
+        self.log_file = os.path.join(alert_dir, 'notifications.jsonl')
+
+    def evaluate(self, df, car_info, timestamp=None):
+        """
+        match new listings and listings with a new price against saved
+        searches and append matches to the notification log
+
+        Args:
+            df: Data Frame of one crawl
+            car_info: dictionary with maker, model and condition
+            timestamp: crawl time in seconds, default is now
+
+        Returns:
+            list of notifications (dictionaries)
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        keys = listing_keys(df)
+        values = listing_values(df)
+        notifications = []
+        for i, key in enumerate(keys):
+            price = values['price'][i]
+            old_price = self.seen.get(key)
+            if np.isnan(price) or price == old_price:
+                continue
+            self.seen[key] = float(price)
+            listing = dict(car_info, **{item: values[item][i] for item in RANGE_KEYS})
+            for subscription in self.index.match(listing):
+                row = df.iloc[i]
+                notifications.append({
+                    'time': timestamp, 'search': subscription['id'],
+                    'change': 'new' if old_price is None else 'price',
+                    'old_price': old_price, 'price': float(price),
+                    'maker': car_info['maker'], 'model': car_info['model'],
+                    'condition': car_info['condition'], 'listing': key,
+                    'name': str(row['name']),
+                    'miles': None if np.isnan(listing['miles']) else float(listing['miles']),
+                    'distance': None if np.isnan(listing['distance']) else float(listing['distance']),
+                    'seller_name': str(row['seller_name'])})
+        with open(self.log_file, 'a') as f:
+            for notification in notifications:
+                f.write(json.dumps(notification) + '\n')
+        return notifications
+
+    def save(self):
+        """write listings seen so far"""
+        with open(self.seen_file + '.tmp', 'w') as f:
+            json.dump(self.seen, f)
+        os.replace(self.seen_file + '.tmp', self.seen_file)
+
+
+def main():
+    """match crawled csv files against saved searches"""
+    if len(sys.argv) < 4:
+        print(
+            "Usage: >> python {} <alert_dir> <json or keyfile> <csvfile> ...".format(sys.argv[0]))
+        sys.exit(1)
+    store = AlertStore(sys.argv[1])
+    makers = [maker['nm'].lower() for maker in load_car_catalog(sys.argv[2])]
+    for csv_name in sys.argv[3:]:
+        df = load_csvfile(csv_name)
+        maker, model, _, condition = parse_csv_name(csv_name, makers)
+        car_info = dict(zip(('maker', 'model', 'condition'),
+                            (item.upper() for item in (maker, model, condition))))
+        # crawl time is the time the csv file was written
+        notifications = store.evaluate(df, car_info, int(os.path.getmtime(csv_name)))
+        print("{:d} notification(s) from {}".format(len(notifications), csv_name))
+    store.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,15 +15,49 @@ import re
 import csv
 import json
 import math
-import urllib.request as urllib2
+import heapq
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # third party library
 from bs4 import BeautifulSoup as bs
 
 # local library
 from handle_search_carscom import generate_url
+from crawl_manifest import load_manifest, compile_job
+from page_archive import PageArchive, count_records, read_records
+from http_session import SESSION
+from egress_pool import EgressPool
 from utility import user_input, write_cars_to_csv, extract_info_from_csvfilename
-from data_analysis import load_csvfile, analyze_price, print_price_info, plot_price_info
+from data_analysis import load_csvfile, analyze_price, print_price_info, plot_price_info, extract_cars
+
+CSV_HEADER = ["name", "brand", "color", "price", "seller_name", "seller_phone",
+              "seller_average_rating", "seller_review_count", "miles", "distance_from_Madison", "Exterior Color",
+              "Interior Color", "Transmission", "Drivetrain", "VIN", "seller_zip"]
+
+# raw result pages are archived when this environment variable is set
+ARCHIVE_ENV = 'CARSCOM_ARCHIVE'
+# sort order name: (key of sort_value(), ascending)
+SORT_KEYS = {
+    'price-lowest': ('price', True),
+    'price-highest': ('price', False),
+    'miles-lowest': ('miles', True),
+    'distance-nearest': ('distance', True),
+    'year-newest': ('year', False),
+    'year-oldest': ('year', True),
+}
+
+# crawls are sent to this crawl service when it is set
+SERVICE_ENV = 'CARSCOM_SERVICE'
+
+# pages are fetched through this pool of http proxies when it is set,
+# e.g. "http://10.0.0.1:3128*8,http://10.0.0.2:3128*8,direct*2"
+PROXIES_ENV = 'CARSCOM_PROXIES'
+# created by egress_pool() on first fetch
+EGRESS = None
+EGRESS_LOCK = threading.Lock()
 
 
 def get_more_info(car_detail):
@@ -57,12 +91,54 @@ def get_more_info(car_detail):
     return car_detail_dict
 
 
-def populate_urls(start_url):
+def count_cars(start_url):
+    """
+    get number of searched cars according to the start_url
+
+    Args:
+        start_url
+
+    Returns:
+        number of cars
+    """
+    cars_per_page = 100
+    url_template = re.sub(
+        r'page=[0-9]+&perPage=[0-9]+',
+        r'page=%d&perPage=%d',
+        start_url)
+    first_url = url_template % (1, cars_per_page)
+    return parse_total_cars(fetch_page(first_url))
+
+
+def parse_total_cars(page):
+    """
+    number of searched cars shown on a result page
+
+    Args:
+        page: page content
+
+    Returns:
+        number of cars
+    """
+    soup = bs(page, 'lxml')
+    total_cars = (int)(
+        soup.find_all(
+            "div",
+            class_="matchcount")[0].find_all(
+            "span",
+            "count")[0].getText().replace(
+            ",",
+            ""))
+    return total_cars
+
+
+def populate_urls(start_url, total_cars=None):
     """
     populate urls according to the start_url
 
     Args:
         start_url
+        total_cars: number of searched cars, fetched if None
 
     Returns:
         url list
@@ -74,18 +150,8 @@ def populate_urls(start_url):
         start_url)
     url_list = []
     # get number of searched cars
-    first_url = url_template % (1, cars_per_page)
-    with urllib2.urlopen(first_url) as uopen:
-        car_url = uopen.read()
-        soup = bs(car_url, 'lxml')
-        total_cars = (int)(
-            soup.find_all(
-                "div",
-                class_="matchcount")[0].find_all(
-                "span",
-                "count")[0].getText().replace(
-                ",",
-                ""))
+    if total_cars is None:
+        total_cars = count_cars(start_url)
     # num_of_urls = (int)(total_cars/cars_per_page) + 1 if total_cars%cars_per_page else (int)(total_cars/cars_per_page)
     num_of_urls = math.ceil(total_cars / cars_per_page)
     for i in range(num_of_urls):
@@ -93,54 +159,97 @@ def populate_urls(start_url):
     return url_list
 
 
+def estimate_pages(tasks):
+    """
+    fetch the number of cars of every task and sort tasks so that
+    the largest queries start earliest
+
+    Args:
+        tasks: list of CrawlTask
+
+    Returns:
+        sorted list of CrawlTask with total_cars filled
+    """
+    if os.environ.get(SERVICE_ENV):
+        # the crawl service counts cars itself
+        return tasks
+    tasks = [task._replace(total_cars=count_cars(task.url)) for task in tasks]
+    tasks.sort(key=lambda task: task.total_cars, reverse=True)
+    for task in tasks:
+        print("{:6d} cars ({:d} pages) {}".format(
+            task.total_cars, math.ceil(task.total_cars / 100),
+            os.path.basename(task.csv_name)))
+    return tasks
+
+
+def run_job(tasks, workers=1):
+    """
+    crawl all tasks of a job, tasks are started in the given order
+
+    Args:
+        tasks: list of CrawlTask
+        workers: number of tasks crawled at the same time
+    """
+    def crawl_task(task):
+        maker, model = task.entries[0].maker, task.entries[0].model
+        print("crawling {} {} {}...".format(task.entries[0].condition, maker, model))
+        craw_from_url(task.url, task.csv_name, task.total_cars, archive)
+        print("finish crawling {} {}...".format(maker, model))
+
+    # all tasks share one archive
+    archive = open_archive()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() re-raises the first exception of any task
+            list(executor.map(crawl_task, tasks))
+    finally:
+        if archive is not None:
+            archive.close()
+
+
 def read_and_crawl():
     """
     crawl multiple models, crawl and compare
     """
-    if len(sys.argv) != 7:
+    if len(sys.argv) not in (7, 8):
         print(
-            "Usage: >> python {} <maker_model_file> <zip> <radius> <used or new> <json or keyfile> <output_dir>".format(
+            "Usage: >> python {} <maker_model_file> <zip> <radius> <used or new> <json or keyfile> <output_dir> [workers]".format(
                 sys.argv[0]))
         print(
             "e.g. python {} <maker_model_file> 53715 25 used <json or keyfile> ./data/".format(sys.argv[0]))
         sys.exit(1)
-    with open(sys.argv[1], 'r') as mmfile:
-        maker_models = (tuple(line.split(":")) for line in mmfile.readlines())
-    # print(maker_models)
-    zipcode = int(sys.argv[2])
-    radius = int(sys.argv[3])
-    condition = sys.argv[4]
+    manifest_file = sys.argv[1]
+    defaults = {'zip': int(sys.argv[2]),
+                'radius': int(sys.argv[3]),
+                'condition': sys.argv[4]}
     car_json_file = sys.argv[5]
     output_dir = sys.argv[6]
+    workers = int(sys.argv[7]) if len(sys.argv) == 8 else 1
+    # validate the whole manifest before sending any request
+    entries, errors = load_manifest(manifest_file, defaults)
+    tasks, compile_errors = compile_job(entries, car_json_file, output_dir)
+    errors += compile_errors
+    if errors:
+        print("{:d} error(s) in {}:".format(len(errors), manifest_file))
+        for error in errors:
+            print("  " + error)
+        sys.exit(1)
     # if the output_dir does not exist, create it
     os.makedirs(output_dir, exist_ok=True)
+    tasks = estimate_pages(tasks)
+    run_job(tasks, workers)
     car_infos = []
     price_infos = []
-    for maker, model in maker_models:
-        maker = maker.strip()
-        model = model.strip()
-        page_num = 1
-        num_per_page = 100
-        start_url = generate_url(
-            maker,
-            model,
-            zipcode,
-            radius,
-            car_json_file,
-            condition,
-            page_num,
-            num_per_page)
-        csv_name = "{}-{}-{:d}-{:d}-{:s}.csv".format(
-            maker, model, zipcode, radius, condition)
-        csv_name = os.path.join(output_dir, csv_name)
-        print("crawling {} {} {}...".format(condition, maker, model))
-        craw_from_url(start_url, csv_name)
-        print("finish crawling...")
-        df = load_csvfile(csv_name)
-        car_info = extract_info_from_csvfilename(csv_name)
-        price_info = analyze_price(df)
-        car_infos.append(car_info)
-        price_infos.append(price_info)
+    for task in tasks:
+        df = load_csvfile(task.csv_name)
+        car_info = extract_info_from_csvfilename(task.csv_name)
+        for entry in task.entries:
+            entry_df = df
+            for requirement in entry.filters:
+                entry_df = extract_cars(entry_df, requirement)
+            price_info = analyze_price(entry_df)
+            car_infos.append(car_info)
+            price_infos.append(price_info)
     plot_price_info(car_infos, price_infos)
 
 
@@ -173,65 +282,359 @@ def pipeline_carscom():
     print_price_info(price_info, car_info)
 
 
-def craw_from_url(start_url, csv_name):
+def sort_value(row, key):
     """
-    crawl data from url and write data to csv file
+    value of a csv row used by top k queries
 
     Args:
-        start_url: start url
-        csv_name: csv filename for saving
+        row: csv row (dictionary)
+        key: 'price', 'miles', 'distance' or 'year'
+
+    Returns:
+        float or None if unknown
+    """
+    if key == 'year':
+        value = row['name'].split()[0]
+    elif key == 'distance':
+        value = row.get('distance_from_Madison')
+    else:
+        value = row.get(key)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def top_k_cars(start_url, k, sort, predicate=None):
+    """
+    best k cars of a search sorted by the site, pages are fetched
+    only until the top k are settled
+
+    Args:
+        start_url: start url generated with sort
+        k: number of cars
+        sort: one of SORT_ORDERS, the same as start_url
+        predicate: function(row) -> bool, optional extra filter
+
+    Returns:
+        (rows, number of fetched pages)
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1, got {}".format(k))
+    key, ascending = SORT_KEYS[sort]
+    cars_per_page = 100
+    url_template = re.sub(
+        r'page=[0-9]+&perPage=[0-9]+',
+        r'page=%d&perPage=%d',
+        start_url)
+    # max heap (by score) of the best k rows, smaller score is better
+    heap = []
+    count = 0
+    page = fetch_page(url_template % (1, cars_per_page))
+    num_pages = max(1, math.ceil(parse_total_cars(page) / cars_per_page))
+    for page_num in range(1, num_pages + 1):
+        if page_num > 1:
+            page = fetch_page(url_template % (page_num, cars_per_page))
+        rows = parse_page(page)
+        page_bound = None
+        for row in rows:
+            value = sort_value(row, key)
+            if value is None:
+                continue
+            score = value if ascending else -value
+            page_bound = score if page_bound is None else max(page_bound, score)
+            if predicate is not None and not predicate(row):
+                continue
+            count += 1
+            item = (-score, count, row)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif score < -heap[0][0]:
+                heapq.heapreplace(heap, item)
+        # later pages only have scores >= page_bound
+        settled = len(heap) == k and page_bound is not None and -heap[0][0] <= page_bound
+        if settled:
+            break
+    best = sorted(heap, key=lambda item: (-item[0], item[1]))
+    return [item[2] for item in best], page_num
+
+
+def topk_carscom():
+    """
+    top k query for cars.com, e.g. 20 cheapest cars within 100 miles
+    """
+    if len(sys.argv) != 9 or sys.argv[8] not in SORT_KEYS or \
+            not sys.argv[7].isdigit() or int(sys.argv[7]) < 1:
+        print(
+            "Usage: >> python {} <maker> <model> <zip> <radius> <used or new> <json or keyfile> <k> <sort>".format(
+                sys.argv[0]))
+        print(
+            "e.g. python {} Honda Accord 53715 100 used <json or keyfile> 20 price-lowest".format(sys.argv[0]))
+        print("sort: {}".format(", ".join(sorted(SORT_KEYS))))
+        sys.exit(1)
+    maker, model = sys.argv[1], sys.argv[2]
+    zipcode, radius = int(sys.argv[3]), int(sys.argv[4])
+    condition, car_json_file = sys.argv[5], sys.argv[6]
+    k, sort = int(sys.argv[7]), sys.argv[8]
+    start_url = generate_url(maker, model, zipcode, radius, car_json_file,
+                             condition, 1, 100, sort)
+    try:
+        rows, num_pages = top_k_cars(start_url, k, sort)
+    except ValueError as err:
+        print(err)
+        sys.exit(1)
+    print("top {:d} {} {} {} ({}), {:d} pages fetched".format(
+        len(rows), condition, maker, model, sort, num_pages))
+    for i, row in enumerate(rows, 1):
+        print("{:3d}. {} $ {} {} miles {} miles away".format(
+            i, row['name'], row['price'], row.get('miles'), row.get('distance_from_Madison')))
+
+
+def egress_pool():
+    """
+    pool of proxies named by CARSCOM_PROXIES, created on first use
+
+    Returns:
+        EgressPool or None if the variable is not set
+    """
+    global EGRESS
+    spec = os.environ.get(PROXIES_ENV)
+    if not spec:
+        return None
+    with EGRESS_LOCK:
+        if EGRESS is None:
+            try:
+                EGRESS = EgressPool.from_spec(spec)
+            except ValueError as err:
+                print("{}: {}".format(PROXIES_ENV, err))
+                sys.exit(1)
+    return EGRESS
+
+
+def fetch_page(url, archive=None):
+    """
+    fetch a page from cars.com
+
+    Args:
+        url: page url
+        archive: PageArchive the raw page is appended to, optional
+
+    Returns:
+        page content (bytes)
+    """
+    pool = egress_pool()
+    page = pool.fetch(url) if pool is not None else SESSION.fetch(url)
+    if archive is not None:
+        archive.append(url, page)
+    return page
+
+
+def parse_page(page):
+    """
+    extract cars information from one result page
+
+    Args:
+        page: page content
+
+    Returns:
+        list of csv rows (dictionaries)
     """
-    url_lst = populate_urls(start_url)
     csv_rows = []
+    soup = bs(page, 'lxml')
+    # get car general information from json script
+    # 04/29/18 YZ use findAll and pick the last
+    contents = soup.findAll('script', type='application/ld+json')[-1].text
+    cars_info = json.loads(contents)
+    # cars_info = json.loads(soup.findall('script', type='application/ld+json').text)
+
+    # get more detailed car information from HTML tags
+    cars_detail_list = soup.find_all(
+        'div', class_='shop-srp-listings__listing')
+    # print(cars_detail_list)
+    if (len(cars_info) != len(cars_detail_list)):
+        raise ValueError(
+            "Error the size of car json information and size of car html information does not match")
+
+    # for each car, extract and insert information into csv table
+    for ind, car_data in enumerate(cars_info):
+        car_info = {"name": car_data['name'], "brand": car_data['brand']['name'], "color":
+                    car_data['color'], "price": car_data['offers']['price'], "seller_name":
+                    car_data['offers']['seller']['name'], "VIN": car_data['vehicleIdentificationNumber']}
+        # need to check for telephone because some sellers does not have
+        # telephone
+        if 'telephone' in car_data['offers']['seller']:
+            car_info['seller_phone'] = car_data['offers']['seller']['telephone']
+
+        # seller zip code is used to compute distance from other places
+        address = car_data['offers']['seller'].get('address')
+        if isinstance(address, dict) and 'postalCode' in address:
+            car_info['seller_zip'] = address['postalCode']
+
+        # need to check for aggregateRating because some seller does not
+        # have rating
+        if 'aggregateRating' in car_data['offers']['seller']:
+            car_info['seller_average_rating'] = car_data['offers']['seller']['aggregateRating']['ratingValue']
+            car_info['seller_review_count'] = car_data['offers']['seller']['aggregateRating']['reviewCount']
+
+        car_details = get_more_info(cars_detail_list[ind])
+
+        # combine two dicts
+        car_dict = {**car_info, **car_details}
+        csv_rows.append(dict(car_dict))
+    return csv_rows
+
+
+def open_archive():
+    """
+    open the raw page archive named by CARSCOM_ARCHIVE
+
+    Returns:
+        PageArchive or None if archiving is off
+    """
+    path = os.environ.get(ARCHIVE_ENV)
+    if not path:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return PageArchive(path)
+
+
+def iter_cars(start_url, total_cars=None, archive=None):
+    """
+    crawl data from url page by page
+
+    Args:
+        start_url: start url
+        total_cars: number of searched cars, fetched if None
+        archive: PageArchive for raw pages, optional
+
+    Yields:
+        csv rows (dictionaries)
+
+    Raises:
+        ValueError if a page can not be parsed
+    """
+    url_lst = populate_urls(start_url, total_cars)
     # start crawling given a list of cars.com urls
-    count = 0
     for url in url_lst:
-        with urllib2.urlopen(url) as uopen:
-            oururl = uopen.read()
-        soup = bs(oururl, 'lxml')
-        # get car general information from json script
-        # 04/29/18 YZ use findAll and pick the last
-        contents = soup.findAll('script', type='application/ld+json')[-1].text
-        cars_info = json.loads(contents)
-        # cars_info = json.loads(soup.findall('script', type='application/ld+json').text)
-
-        # get more detailed car information from HTML tags
-        cars_detail_list = soup.find_all(
-            'div', class_='shop-srp-listings__listing')
-        # print(cars_detail_list)
-        if (len(cars_info) != len(cars_detail_list)):
-            print(
-                "Error the size of car json information and size of car html information does not match")
+        page = fetch_page(url, archive)
+        yield from parse_page(page)
+
+
+def iter_remote_cars(service_url, start_url):
+    """
+    get crawled data from a crawl service (see crawl_service.py)
+
+    Args:
+        service_url: e.g. http://127.0.0.1:8765
+        start_url: start url
+
+    Yields:
+        csv rows (dictionaries)
+    """
+    query = urllib.parse.urlencode({'url': start_url})
+    with urllib.request.urlopen("{}/search?{}".format(service_url.rstrip('/'), query)) as response:
+        for line in response:
+            message = json.loads(line.decode('utf-8'))
+            if message['type'] == 'listing':
+                yield message['listing']
+            elif message['type'] == 'error':
+                raise ValueError(message['error'])
+
+
+def craw_from_url(start_url, csv_name, total_cars=None, archive=None):
+    """
+    crawl data from url and write data to csv file, the crawl
+    service named by CARSCOM_SERVICE is used if it is set
+
+    Args:
+        start_url: start url
+        csv_name: csv filename for saving
+        total_cars: number of searched cars, fetched if None
+        archive: PageArchive for raw pages, default is open_archive()
+    """
+    service_url = os.environ.get(SERVICE_ENV)
+    if service_url:
+        try:
+            csv_rows = list(iter_remote_cars(service_url, start_url))
+        except ValueError as err:
+            print(err)
             sys.exit(1)
+        write_cars_to_csv(csv_name, CSV_HEADER, csv_rows)
+        return
+    own_archive = archive is None
+    if own_archive:
+        archive = open_archive()
+    try:
+        csv_rows = list(iter_cars(start_url, total_cars, archive))
+    except ValueError as err:
+        print(err)
+        sys.exit(1)
+    finally:
+        if own_archive and archive is not None:
+            archive.close()
+    write_cars_to_csv(csv_name, CSV_HEADER, csv_rows)
+    SESSION.print_stats()
+    if egress_pool() is not None:
+        egress_pool().print_stats()
+
+
+def parse_archive_range(args):
+    """
+    parse records [start, stop) of an archive
+
+    Args:
+        args: (archive path, start, stop)
+
+    Returns:
+        (csv rows, number of pages failed to parse)
+    """
+    path, start, stop = args
+    csv_rows = []
+    num_failed = 0
+    for url, page, timestamp in read_records(path, start, stop):
+        try:
+            rows = parse_page(page)
+        except (ValueError, KeyError, IndexError, AttributeError):
+            num_failed += 1
             continue
+        # every page of a search has the same source url
+        source_url = re.sub(r'page=[0-9]+', 'page=1', url or '')
+        for row in rows:
+            row['source_url'] = source_url
+            row['crawl_time'] = timestamp
+        csv_rows.extend(rows)
+    return csv_rows, num_failed
 
-        # for each car, extract and insert information into csv table
-        for ind, car_data in enumerate(cars_info):
-            count += 1
-            car_info = {"name": car_data['name'], "brand": car_data['brand']['name'], "color":
-                        car_data['color'], "price": car_data['offers']['price'], "seller_name":
-                        car_data['offers']['seller']['name'], "VIN": car_data['vehicleIdentificationNumber']}
-            # need to check for telephone because some sellers does not have
-            # telephone
-            if 'telephone' in car_data['offers']['seller']:
-                car_info['seller_phone'] = car_data['offers']['seller']['telephone']
-
-            # need to check for aggregateRating because some seller does not
-            # have rating
-            if 'aggregateRating' in car_data['offers']['seller']:
-                car_info['seller_average_rating'] = car_data['offers']['seller']['aggregateRating']['ratingValue']
-                car_info['seller_review_count'] = car_data['offers']['seller']['aggregateRating']['reviewCount']
-
-            car_details = get_more_info(cars_detail_list[ind])
-
-            # combine two dicts
-            car_dict = {**car_info, **car_details}
-            csv_rows.append(dict(car_dict))
-
-    csv_header = ["name", "brand", "color", "price", "seller_name", "seller_phone",
-                  "seller_average_rating", "seller_review_count", "miles", "distance_from_Madison", "Exterior Color",
-                  "Interior Color", "Transmission", "Drivetrain", "VIN"]
-    write_cars_to_csv(csv_name, csv_header, csv_rows)
+
+def reparse_archive():
+    """
+    run the current extraction over an archive of raw pages
+    on all cores and write rows to csv file, every row keeps
+    the search (source_url) and fetch time (crawl_time) of its page
+    """
+    if len(sys.argv) != 3:
+        print(
+            "Usage: >> python {} <archive> <csv_name>".format(sys.argv[0]))
+        print(
+            "e.g. python {} data/archive data/reparsed.csv".format(sys.argv[0]))
+        sys.exit(1)
+    path, csv_name = sys.argv[1], sys.argv[2]
+    if not os.path.exists(path + '.idx'):
+        print("{}.idx does not exist".format(path))
+        sys.exit(1)
+    num_records = count_records(path)
+    chunk = 64
+    ranges = [(path, start, start + chunk)
+              for start in range(0, num_records, chunk)]
+    csv_rows = []
+    num_failed = 0
+    with ProcessPoolExecutor() as executor:
+        for rows, failed in executor.map(parse_archive_range, ranges):
+            csv_rows.extend(rows)
+            num_failed += failed
+    print("parse {:d} pages, {:d} failed".format(num_records, num_failed))
+    write_cars_to_csv(csv_name, CSV_HEADER + ['source_url', 'crawl_time'], csv_rows)
 
 
 if __name__ == "__main__":
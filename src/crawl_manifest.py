@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module contains functions that load a batch crawl manifest,
+validate it against the cars.com catalog and compile it into
+a single crawl job
+
+A manifest has one search per line. The simplest line is the
+old maker:model format, options override the command line defaults
+
+    # comment
+    Toyota : Camry
+    Honda : Accord | zip=60601 radius=50 condition=used
+    BMW : X3 | price=30000-45000 distance=0-50
+"""
+
+# standard library
+import os
+from collections import namedtuple, OrderedDict
+
+# local library
+from handle_search_carscom import load_car_catalog, find_makerID_and_modelID, build_url
+
+
+ManifestEntry = namedtuple('ManifestEntry',
+                           ['line_num', 'maker', 'model', 'zipcode',
+                            'radius', 'condition', 'filters'])
+
+# entries which generate the same url share one CrawlTask
+CrawlTask = namedtuple('CrawlTask',
+                       ['url', 'csv_name', 'entries', 'total_cars'])
+
+CONDITIONS = ('new', 'used', 'old', 'all')
+FILTER_KEYS = ('price', 'distance')
+
+
+def parse_range(text):
+    """
+    parse a 'low-high' string
+
+    Args:
+        text: e.g. '20000-30000'
+
+    Returns:
+        (low, high) floats
+    """
+    low, high = text.split('-')
+    low, high = float(low), float(high)
+    if low > high:
+        raise ValueError("low > high")
+    return low, high
+
+
+def parse_manifest_line(line, line_num, defaults):
+    """
+    parse one manifest line into a ManifestEntry
+
+    Args:
+        line: manifest line without comment
+        line_num: line number (for error message)
+        defaults: dict with 'zip', 'radius' and 'condition'
+
+    Returns:
+        ManifestEntry
+
+    Raises:
+        ValueError with a readable message
+    """
+    search, _, options = line.partition('|')
+    if ':' not in search:
+        raise ValueError("expect <maker> : <model>, got '{}'".format(search.strip()))
+    maker, model = (item.strip() for item in search.split(':', 1))
+    if not maker or not model:
+        raise ValueError("empty maker or model")
+    zipcode, radius = defaults['zip'], defaults['radius']
+    condition = defaults['condition']
+    filters = []
+    for option in options.split():
+        key, sep, value = option.partition('=')
+        key = key.lower()
+        if not sep or not value:
+            raise ValueError("expect key=value, got '{}'".format(option))
+        if key == 'zip':
+            if not (value.isdigit() and len(value) == 5):
+                raise ValueError("invalid zip '{}'".format(value))
+            zipcode = int(value)
+        elif key == 'radius':
+            if not value.isdigit():
+                raise ValueError("invalid radius '{}'".format(value))
+            radius = int(value)
+        elif key == 'condition':
+            if value.lower() not in CONDITIONS:
+                raise ValueError("invalid condition '{}'".format(value))
+            condition = value.lower()
+        elif key in FILTER_KEYS:
+            try:
+                filters.append((key, parse_range(value)))
+            except ValueError:
+                raise ValueError("invalid {} range '{}'".format(key, value))
+        else:
+            raise ValueError("unknown option '{}'".format(key))
+    return ManifestEntry(line_num, maker, model, zipcode, radius,
+                         condition, tuple(filters))
+
+
+def load_manifest(manifest_file, defaults):
+    """
+    read a manifest file, every line is checked before returning
+
+    Args:
+        manifest_file: manifest filename
+        defaults: dict with 'zip', 'radius' and 'condition'
+
+    Returns:
+        (entries, errors): list of ManifestEntry and list of error strings
+    """
+    entries = []
+    errors = []
+    with open(manifest_file, 'r') as mfile:
+        for line_num, line in enumerate(mfile, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                entries.append(parse_manifest_line(line, line_num, defaults))
+            except ValueError as err:
+                errors.append("line {:d}: {}".format(line_num, err))
+    return entries, errors
+
+
+def compile_job(entries, car_json_file, output_dir, sort=None):
+    """
+    resolve every entry against the catalog and merge entries
+    that generate identical urls
+
+    Args:
+        entries: list of ManifestEntry
+        car_json_file: cars.com mk-md json file
+        output_dir: directory for csv files
+        sort: one of SORT_ORDERS, default is site relevance
+
+    Returns:
+        (tasks, errors): list of CrawlTask and list of error strings
+    """
+    catalog = load_car_catalog(car_json_file)
+    tasks = OrderedDict()
+    errors = []
+    for entry in entries:
+        mkid, mdid = find_makerID_and_modelID(entry.maker, entry.model, catalog)
+        if not mkid:
+            errors.append("line {:d}: invalid maker name {}".format(
+                entry.line_num, entry.maker))
+            continue
+        if not mdid:
+            errors.append("line {:d}: invalid model name {} for {}".format(
+                entry.line_num, entry.model, entry.maker))
+            continue
+        url = build_url(mkid, mdid, entry.zipcode, entry.radius,
+                        entry.condition, 1, 100, sort)
+        if url not in tasks:
+            csv_name = "{}-{}-{:d}-{:d}-{:s}.csv".format(
+                entry.maker, entry.model, entry.zipcode, entry.radius,
+                entry.condition)
+            csv_name = os.path.join(output_dir, csv_name)
+            tasks[url] = CrawlTask(url, csv_name, [], None)
+        # identical searches with identical filters are analyzed once
+        if all(item.filters != entry.filters for item in tasks[url].entries):
+            tasks[url].entries.append(entry)
+    return list(tasks.values()), errors
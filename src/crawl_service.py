@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module contains a local crawl service with a small
+HTTP/JSON API
+
+    GET /search?maker=Audi&model=Q3&zip=53715&radius=100&condition=new
+    GET /search?url=<cars.com search url>
+
+streams one JSON message per line: {"type": "listing", ...} for every
+car, {"type": "stats", ...} after every page and {"type": "done", ...}
+at the end. Identical queries running at the same time share one
+crawl, and finished crawls are served from memory for ttl seconds.
+
+Set CARSCOM_SERVICE=http://127.0.0.1:8765 to make the command line
+tools and the GUI use the service. Pages crawled by the service are
+archived to CARSCOM_ARCHIVE if it is set.
+"""
+
+# standard library
+import sys
+import json
+import math
+import time
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local library
+from handle_search_carscom import load_car_catalog, find_makerID_and_modelID, build_url
+from cars_com_crawling import populate_urls, fetch_page, parse_page, open_archive
+
+
+class CrawlJob:
+    """one crawl, shared by all clients asking the same query"""
+
+    def __init__(self, start_url, archive=None):
+        """
+        Args:
+            start_url: start url
+            archive: PageArchive for raw pages, optional
+        """
+        self.start_url = start_url
+        self.archive = archive
+        self.rows = []
+        self.error = None
+        self.done = False
+        self.finished = None
+        self.cond = threading.Condition()
+        # running price statistics
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def run(self):
+        """crawl page by page and wake up waiting clients"""
+        try:
+            for url in populate_urls(self.start_url):
+                page_rows = parse_page(fetch_page(url, self.archive))
+                with self.cond:
+                    for row in page_rows:
+                        self._add_price(row.get('price'))
+                    self.rows.extend(page_rows)
+                    self.cond.notify_all()
+        except Exception as err:
+            with self.cond:
+                self.error = str(err)
+        with self.cond:
+            self.done = True
+            self.finished = time.time()
+            self.cond.notify_all()
+
+    def _add_price(self, price):
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            return
+        if not math.isfinite(price) or price <= 0:
+            return
+        self.count += 1
+        self.total += price
+        self.total_sq += price * price
+        self.min = min(self.min, price)
+        self.max = max(self.max, price)
+
+    def stats(self):
+        """running price statistics, call with self.cond held"""
+        if not self.count:
+            return {'count': 0}
+        mean = self.total / self.count
+        var = 0.0
+        if self.count > 1:
+            var = max(0.0, (self.total_sq - self.count * mean * mean) / (self.count - 1))
+        return {'count': self.count, 'mean': mean, 'std': math.sqrt(var),
+                'min': self.min, 'max': self.max}
+
+    def stream(self):
+        """
+        Yields:
+            messages (dictionaries), listings already crawled come first
+        """
+        index = 0
+        while True:
+            with self.cond:
+                while index == len(self.rows) and not self.done:
+                    self.cond.wait()
+                rows = self.rows[index:]
+                index = len(self.rows)
+                stats = self.stats()
+                done, error = self.done, self.error
+            for row in rows:
+                yield {'type': 'listing', 'listing': row}
+            if rows:
+                yield dict(stats, type='stats')
+            if done:
+                if error:
+                    yield {'type': 'error', 'error': error}
+                else:
+                    yield dict(stats, type='done')
+                return
+
+
+class CrawlService:
+    """merge identical in-flight queries and cache finished crawls"""
+
+    def __init__(self, car_json_file, ttl=900):
+        """
+        Args:
+            car_json_file: cars.com mk-md json file
+            ttl: seconds a finished crawl is served from memory
+        """
+        self.catalog = load_car_catalog(car_json_file)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # all jobs share one archive
+        self.archive = open_archive()
+
+    def close(self):
+        """close the page archive"""
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def resolve(self, query):
+        """
+        turn a query into a cars.com search url
+
+        Args:
+            query: dictionary parsed from query string
+
+        Returns:
+            start url
+
+        Raises:
+            ValueError for an invalid query
+        """
+        if 'url' in query:
+            url = query['url']
+            if not url.startswith('https://www.cars.com/'):
+                raise ValueError("only cars.com url is supported")
+            return url
+        try:
+            maker, model = query['maker'], query['model']
+            zipcode, radius = int(query['zip']), int(query['radius'])
+        except (KeyError, ValueError):
+            raise ValueError("expect maker, model, zip and radius")
+        condition = query.get('condition', 'new')
+        mkid, mdid = find_makerID_and_modelID(maker, model, self.catalog)
+        if not mkid or not mdid:
+            raise ValueError("invalid maker or model {} {}".format(maker, model))
+        return build_url(mkid, mdid, zipcode, radius, condition, 1, 100)
+
+    def get_job(self, start_url):
+        """
+        running or fresh job of the url, a new job is started if
+        there is none
+
+        Args:
+            start_url: start url
+
+        Returns:
+            CrawlJob
+        """
+        with self.lock:
+            now = time.time()
+            # forget expired jobs
+            for url, job in list(self.jobs.items()):
+                if job.done and (job.error or now - job.finished > self.ttl):
+                    del self.jobs[url]
+            job = self.jobs.get(start_url)
+            if job is None:
+                job = CrawlJob(start_url, self.archive)
+                self.jobs[start_url] = job
+                threading.Thread(target=job.run, daemon=True).start()
+            return job
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """http handler, self.server.service is a CrawlService"""
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path != '/search':
+            self.send_json(404, {'type': 'error', 'error': 'not found'})
+            return
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        try:
+            start_url = self.server.service.resolve(query)
+        except ValueError as err:
+            self.send_json(400, {'type': 'error', 'error': str(err)})
+            return
+        job = self.server.service.get_job(start_url)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for message in job.stream():
+                self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+                if message['type'] != 'listing':
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # client went away, the crawl keeps running for others
+            pass
+
+    def send_json(self, status, message):
+        body = json.dumps(message).encode('utf-8') + b'\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        print("{} {}".format(self.address_string(), fmt % args))
+
+
+def serve(car_json_file, port=8765, ttl=900):
+    """
+    run crawl service on localhost
+
+    Args:
+        car_json_file: cars.com mk-md json file
+        port: port number
+        ttl: seconds a finished crawl is served from memory
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = CrawlService(car_json_file, ttl)
+    print("crawl service on http://127.0.0.1:{:d}".format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+    finally:
+        server.service.close()
+
+
+def main():
+    """start crawl service"""
+    if len(sys.argv) not in (2, 3, 4):
+        print(
+            "Usage: >> python {} <json or keyfile> [port] [ttl_seconds]".format(sys.argv[0]))
+        sys.exit(1)
+    car_json_file = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    ttl = int(sys.argv[3]) if len(sys.argv) > 3 else 900
+    serve(car_json_file, port, ttl)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,9 +21,18 @@ import seaborn as sns
 
 # local library
 from utility import extract_info_from_csvfilename
+from geo_distance import add_distance_column
 
 sns.set()
 
+# declared schema of crawled csv files, used by load_csvfile(compact=True)
+CATEGORY_COLUMNS = ['brand', 'color', 'seller_name', 'Exterior Color',
+                    'Interior Color', 'Transmission', 'Drivetrain']
+NUMERIC_COLUMNS = ['price', 'miles', 'seller_average_rating',
+                   'seller_review_count']
+# kept as float64, so price statistics are the same as without compact
+EXACT_COLUMNS = ['price']
+
 
 def add_year_column(df):
     """
@@ -35,16 +44,11 @@ def add_year_column(df):
     Returns:
         new Data Frame with year column added
     """
-    names = df['name']
-    years = []
-    for name in names:
-        year_str = name.split()[0]
-        try:
-            year = int(year_str)
-        except ValueError:
-            year = 2018  # default
-        years.append(year)
-    df['year'] = years
+    # first word of name, e.g. '2018 Audi Q3 2.0T Premium Plus'
+    year_str = df['name'].astype(str).str.split(n=1).str[0]
+    years = pd.to_numeric(year_str, errors='coerce')
+    years[years != years.round()] = np.nan
+    df['year'] = years.fillna(2018).astype(int)  # default
 
 
 def extract_cars(df, requirement):
@@ -55,6 +59,9 @@ def extract_cars(df, requirement):
         df: Data Frame crawled from cars.com
         requirement: e.g. ('price', (50000, 60000))
                           ('distance', (0, 100))
+                          ('distance', (0, 100), 60601) distance from
+                          any zip code, needs seller_zip column and
+                          zip centroid table (see geo_distance.py)
 
     Returns:
         all the data satisfying the requirement
@@ -62,6 +69,10 @@ def extract_cars(df, requirement):
     attribute = requirement[0]
     if attribute == 'price':
         low, high = requirement[1]
+    elif attribute == 'distance' and len(requirement) > 2:
+        df = df.copy()
+        attribute = add_distance_column(df, requirement[2])
+        low, high = requirement[1]
     elif attribute == 'distance':
         for item in df.columns:
             if item.startswith('distance_from'):
@@ -92,12 +103,92 @@ def print_df(df):
         print(df[['name', 'price', 'color']].sort_values('price'))
 
 
-def load_csvfile(csvfile):
+def compact_df(df):
+    """
+    convert columns of a Data Frame to the compact types declared
+    in CATEGORY_COLUMNS, NUMERIC_COLUMNS and EXACT_COLUMNS (in place)
+
+    Args:
+        df: Data Frame crawled from cars.com
+
+    Returns:
+        df
+    """
+    for column in df.columns:
+        if column in CATEGORY_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif column in EXACT_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(np.float64)
+        elif column in NUMERIC_COLUMNS or column.startswith('distance_from'):
+            values = pd.to_numeric(df[column], errors='coerce')
+            if values.isnull().any() or (values != values.round()).any():
+                # integer types can not hold NaN
+                df[column] = values.astype(np.float32)
+            else:
+                df[column] = pd.to_numeric(values, downcast='integer')
+    return df
+
+
+def concat_compact(dfs):
+    """
+    concatenate compact Data Frames, categorical columns stay
+    categorical with the union of categories
+
+    Args:
+        dfs: list of compact Data Frames
+
+    Returns:
+        Data Frame
+    """
+    if len(dfs) == 1:
+        return dfs[0]
+    df = pd.concat(dfs, ignore_index=True)
+    for column in df.columns:
+        if all(isinstance(item[column].dtype, pd.CategoricalDtype) for item in dfs):
+            df[column] = pd.api.types.union_categoricals(
+                [item[column] for item in dfs])
+        elif column in EXACT_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(np.float64)
+        elif column in NUMERIC_COLUMNS or column.startswith('distance_from'):
+            # chunks may have different integer sizes or NaN
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+            if df[column].isnull().any():
+                df[column] = df[column].astype(np.float32)
+            else:
+                df[column] = pd.to_numeric(df[column], downcast='integer')
+    return df
+
+
+def memory_report(df):
+    """
+    print memory usage of every column
+
+    Args:
+        df: Data Frame
+
+    Returns:
+        total bytes
+    """
+    usage = df.memory_usage(deep=True)
+    for column, nbytes in usage.items():
+        print("{:s} {:>14,d} bytes {}".format(
+            str(column).ljust(24), int(nbytes),
+            df[column].dtype if column in df.columns else ''))
+    total = int(usage.sum())
+    print("{:s} {:>14,d} bytes".format('total'.ljust(24), total))
+    return total
+
+
+def load_csvfile(csvfile, compact=False, chunksize=None, usecols=None):
     """
     check existence and load csv file to pandas data frame
 
     Args:
         csvfile: csv filename
+        compact: use categorical and downcast numeric types
+        chunksize: read (and compact) this many rows at a time,
+                   keeps peak memory low for large files
+        usecols: only load these columns, optional
 
     Returns:
         Data Frame loaded from csv file
@@ -105,8 +196,16 @@ def load_csvfile(csvfile):
     if not os.path.exists(csvfile):
         print("{} does not exist".format(csvfile))
         sys.exit(1)
-    df = pd.read_csv(csvfile)
-    return df
+    if not compact:
+        df = pd.read_csv(csvfile, usecols=usecols)
+        return df
+    # read text columns as str so every chunk has the same types
+    dtype = {column: str for column in CATEGORY_COLUMNS}
+    if chunksize is None:
+        return compact_df(pd.read_csv(csvfile, dtype=dtype, usecols=usecols))
+    chunks = [compact_df(chunk) for chunk in pd.read_csv(
+        csvfile, dtype=dtype, usecols=usecols, chunksize=chunksize)]
+    return concat_compact(chunks)
 
 
 def analyze_price(df, plot=False):
@@ -155,13 +254,14 @@ def print_price_info(price_info, car_info):
     print("{:s} = $ {:,.2f}".format('std price'.ljust(n), price_info['std']))
 
 
-def plot_price_info(car_infos, price_infos):
+def draw_price_info(ax, car_infos, price_infos):
     """
-    plot price info
+    draw price info on a matplotlib axes
 
     Args:
-        price_info: a dictionary stores price information
-        car_info: a dictionary stores car information
+        ax: matplotlib axes
+        car_infos: a list of dictionaries store car information
+        price_infos: a list of dictionaries store price information
 
     Returns:
         None
@@ -170,7 +270,6 @@ def plot_price_info(car_infos, price_infos):
     n = len(car_infos)
     mins, means, maxes, stds = np.zeros(
         n), np.zeros(n), np.zeros(n), np.zeros(n)
-    fig, ax = plt.subplots(figsize=(8, 8))
     for i in range(n):
         models.append(car_infos[i]['model'])
         price_info = price_infos[i]
@@ -182,24 +281,47 @@ def plot_price_info(car_infos, price_infos):
     ax.errorbar(
         np.arange(n), means, [
             means - mins, maxes - means], fmt='.k', ecolor='blue', lw=2)
-    plt.xticks(np.arange(n), models)
+    ax.set_xticks(np.arange(n))
+    ax.set_xticklabels(models)
     fmt = '${x:,.0f}'
     tick = mtick.StrMethodFormatter(fmt)
     ax.yaxis.set_major_formatter(tick)
-    plt.ylabel('price')
+    ax.set_ylabel('price')
+
+
+def plot_price_info(car_infos, price_infos):
+    """
+    plot price info
+
+    Args:
+        price_info: a dictionary stores price information
+        car_info: a dictionary stores car information
+
+    Returns:
+        None
+    """
+    fig, ax = plt.subplots(figsize=(8, 8))
+    draw_price_info(ax, car_infos, price_infos)
     plt.show()
 
 
 def main():
     """show how to use analyze_price()"""
-    if len(sys.argv) != 4:
+    if len(sys.argv) not in (4, 5) or (len(sys.argv) == 5 and sys.argv[4] != 'memory'):
         print(
-            "Usage: >> python {} <csvfile> <min_price> <max_price>".format(
+            "Usage: >> python {} <csvfile> <min_price> <max_price> [memory]".format(
                 sys.argv[0]))
         sys.exit(1)
     csvfile = sys.argv[1]
     min_price, max_price = float(sys.argv[2]), float(sys.argv[3])
     df = load_csvfile(csvfile)
+    if len(sys.argv) == 5:
+        # compare memory of the plain and the compact Data Frame
+        print("plain:")
+        plain = memory_report(df)
+        print("compact:")
+        compact = memory_report(load_csvfile(csvfile, compact=True))
+        print("compact uses {:.1%} of plain".format(compact / plain))
     car_info = extract_info_from_csvfilename(csvfile)
     price_info = analyze_price(df, plot=False)
     print_price_info(price_info, car_info)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module fits price against year, miles and distance for
+every maker/model and scores every listing by how much cheaper
+it is than the fitted price
+
+All groups are fitted at once: the normal equations X^T X and
+X^T y of every group are accumulated with np.bincount and solved
+as one batch. These sums are cached with the coefficients, so a
+new crawl only adds its own sums.
+"""
+
+# standard library
+import os
+import sys
+import json
+
+# third party library
+import numpy as np
+import pandas as pd
+
+# local library
+from utility import parse_csv_name
+from handle_search_carscom import load_car_catalog
+from data_analysis import load_csvfile, add_year_column, concat_compact
+
+FEATURES = ['year', 'miles', 'distance']
+RIDGE = 1e-3  # keeps groups with constant year (e.g. all new cars) solvable
+
+
+def load_listings(csv_names, makers):
+    """
+    load crawled csv files into one Data Frame with maker, model
+    and condition columns (upper case)
+
+    Args:
+        csv_names: list of csv filenames
+        makers: lower case maker names of the catalog
+
+    Returns:
+        Data Frame
+    """
+    dfs = []
+    for csv_name in csv_names:
+        df = load_csvfile(csv_name, compact=True)
+        maker, model, _, condition = parse_csv_name(csv_name, makers)
+        for key, value in zip(('maker', 'model', 'condition'), (maker, model, condition)):
+            df[key] = value.upper()
+        dfs.append(df)
+    return concat_compact(dfs)
+
+
+def design_matrix(df):
+    """
+    extract features and price from listings
+
+    Args:
+        df: Data Frame with name, price, miles and distance_from_* columns
+
+    Returns:
+        (features (n x len(FEATURES)), price (n,), group keys (n,))
+    """
+    if 'year' not in df.columns:
+        add_year_column(df)
+    distance_col = [item for item in df.columns if item.startswith('distance_from')]
+    distance = df[distance_col[0]] if distance_col else pd.Series(0.0, index=df.index)
+    features = np.column_stack([
+        df['year'].values.astype(float),
+        # new cars have no mileage
+        pd.to_numeric(df['miles'], errors='coerce').fillna(0).values.astype(float),
+        pd.to_numeric(distance, errors='coerce').fillna(0).values.astype(float)])
+    price = pd.to_numeric(df['price'], errors='coerce').values.astype(float)
+    keys = (df['maker'].astype(str).str.upper() + '|' +
+            df['model'].astype(str).str.upper()).values
+    return features, price, keys
+
+
+def normal_equations(x, y, group, num_groups):
+    """
+    X^T X and X^T y of every group
+
+    Args:
+        x: (n, p) design matrix
+        y: (n,) target
+        group: (n,) group index
+        num_groups: number of groups
+
+    Returns:
+        (xtx (g, p, p), xty (g, p))
+    """
+    p = x.shape[1]
+    xtx = np.empty((num_groups, p, p))
+    xty = np.empty((num_groups, p))
+    for i in range(p):
+        xty[:, i] = np.bincount(group, x[:, i] * y, minlength=num_groups)
+        for j in range(i, p):
+            xtx[:, i, j] = np.bincount(group, x[:, i] * x[:, j], minlength=num_groups)
+            xtx[:, j, i] = xtx[:, i, j]
+    return xtx, xty
+
+
+def fit_deal_model(df, model=None):
+    """
+    fit (or update) price model of every maker/model
+
+    Args:
+        df: listings from load_listings()
+        model: cached model to be updated, optional
+
+    Returns:
+        model: a dictionary which can be saved by save_deal_model()
+    """
+    features, price, keys = design_matrix(df)
+    valid = np.isfinite(price) & (price > 0)
+    features, price, keys = features[valid], price[valid], keys[valid]
+    if model is None:
+        # feature scaling is fixed by the first fit
+        std = features.std(axis=0)
+        model = {'features': FEATURES,
+                 'mean': features.mean(axis=0).tolist(),
+                 'std': np.where(std > 0, std, 1.0).tolist(),
+                 'groups': {}}
+    x = np.column_stack([np.ones(len(price)),
+                         (features - model['mean']) / model['std']])
+    group, names = pd.factorize(keys)
+    xtx, xty = normal_equations(x, price, group, len(names))
+    groups = model['groups']
+    for i, name in enumerate(names):
+        if name in groups:
+            xtx[i] += np.array(groups[name]['xtx'])
+            xty[i] += np.array(groups[name]['xty'])
+    penalty = RIDGE * np.diag([0.0] + [1.0] * len(FEATURES))
+    coefs = np.linalg.solve(xtx + penalty * xtx[:, :1, :1], xty[..., None])[..., 0]
+    for i, name in enumerate(names):
+        groups[name] = {'xtx': xtx[i].tolist(),
+                        'xty': xty[i].tolist(),
+                        'coef': coefs[i].tolist()}
+    return model
+
+
+def score_listings(df, model):
+    """
+    score listings with a fitted model, listings of unknown
+    maker/model get NaN
+
+    Args:
+        df: listings from load_listings()
+        model: model from fit_deal_model()
+
+    Returns:
+        new Data Frame with expected_price, residual and deal_score columns,
+        deal_score is the fraction below expected price (higher is better)
+    """
+    features, price, keys = design_matrix(df)
+    x = np.column_stack([np.ones(len(price)),
+                         (features - model['mean']) / model['std']])
+    names = list(model['groups'])
+    coefs = np.array([model['groups'][name]['coef'] for name in names]
+                     ).reshape(len(names), x.shape[1])
+    index = pd.Index(names).get_indexer(keys)
+    known = index >= 0
+    expected = np.full(len(price), np.nan)
+    expected[known] = np.einsum('ij,ij->i', x[known], coefs[index[known]])
+    new_df = df.copy()
+    new_df['expected_price'] = expected
+    new_df['residual'] = price - expected
+    with np.errstate(divide='ignore', invalid='ignore'):
+        new_df['deal_score'] = (expected - price) / expected
+    return new_df
+
+
+def save_deal_model(model, model_file):
+    """save model to json file"""
+    with open(model_file, 'w') as f:
+        json.dump(model, f)
+
+
+def load_deal_model(model_file):
+    """load model from json file, None if it does not exist"""
+    if not os.path.exists(model_file):
+        return None
+    with open(model_file, 'r') as f:
+        return json.load(f)
+
+
+def main():
+    """fit model with new crawls, or score crawls and print best deals"""
+    if len(sys.argv) < 5 or sys.argv[1] not in ('fit', 'score'):
+        print(
+            "Usage: >> python {} <fit or score> <model_file> <json or keyfile> <csvfile> ...".format(
+                sys.argv[0]))
+        sys.exit(1)
+    command, model_file, csv_names = sys.argv[1], sys.argv[2], sys.argv[4:]
+    makers = [maker['nm'].lower() for maker in load_car_catalog(sys.argv[3])]
+    df = load_listings(csv_names, makers)
+    model = load_deal_model(model_file)
+    if command == 'fit':
+        model = fit_deal_model(df, model)
+        save_deal_model(model, model_file)
+        print("fit {:d} listings, {:d} models".format(len(df), len(model['groups'])))
+    else:
+        if model is None:
+            print("{} does not exist".format(model_file))
+            sys.exit(1)
+        scored = score_listings(df, model)
+        scored = scored[np.isfinite(scored['deal_score'])]
+        print(scored[['name', 'price', 'miles', 'expected_price', 'deal_score']]
+              .sort_values('deal_score', ascending=False).head(20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module spreads page fetches over a pool of egress endpoints
+(http proxies, or the direct connection)
+
+Every endpoint has a concurrency limit and a health record
+(moving averages of latency and error rate). A request goes to the
+least loaded healthy endpoint. An endpoint failing too often is
+ejected for a while, then re-admitted on probation with a single
+request at a time until it succeeds again.
+"""
+
+# standard library
+import time
+import threading
+import http.client
+import urllib.error
+
+# local library
+from http_session import SESSION
+
+DIRECT = 'direct'
+DEFAULT_CONCURRENCY = 4
+DECAY = 0.2              # weight of the newest sample in moving averages
+MAX_FAILURES = 3         # consecutive failures before ejection
+MAX_ERROR_RATE = 0.5     # moving error rate before ejection
+EJECT_SECONDS = 30       # first ejection, doubled on every ejection in a row
+MAX_EJECT_SECONDS = 600
+MAX_ATTEMPTS = 3
+# responses caused by the endpoint (or by the site limiting it), not by the url
+RETRY_CODES = (407, 429, 502, 503, 504)
+
+
+class Endpoint:
+    """one egress endpoint and its health"""
+
+    def __init__(self, proxy, max_concurrency=DEFAULT_CONCURRENCY):
+        """
+        Args:
+            proxy: proxy url, None for the direct connection
+            max_concurrency: max number of requests in flight
+        """
+        self.proxy = proxy
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.latency = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.probation = False
+        self.num_requests = 0
+        self.num_errors = 0
+
+    def name(self):
+        """printable name"""
+        return self.proxy or DIRECT
+
+    def limit(self, now):
+        """number of requests allowed in flight at time now"""
+        if now < self.ejected_until:
+            return 0
+        return 1 if self.probation else self.max_concurrency
+
+    def load(self):
+        """fraction of concurrency in use"""
+        return self.in_flight / self.max_concurrency
+
+    def score(self):
+        """expected cost of a request, lower is better"""
+        return (self.latency or 0.0) * (1 + 4 * self.error_rate)
+
+
+class EgressPool:
+    """least loaded scheduling over healthy endpoints"""
+
+    def __init__(self, endpoints, session=SESSION, eject_seconds=EJECT_SECONDS):
+        """
+        Args:
+            endpoints: list of Endpoint
+            session: HTTPSession used for all endpoints
+            eject_seconds: first ejection time, doubled on every ejection in a row
+        """
+        if not endpoints:
+            raise ValueError("egress pool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.session = session
+        self.eject_seconds = eject_seconds
+        self.cond = threading.Condition()
+
+    @classmethod
+    def from_spec(cls, spec, session=SESSION, eject_seconds=EJECT_SECONDS):
+        """
+        create a pool from a comma separated list of endpoints, each
+        one optionally followed by *concurrency
+
+        Args:
+            spec: e.g. "http://10.0.0.1:3128*8,http://10.0.0.2:3128,direct*2"
+            session: HTTPSession used for all endpoints
+            eject_seconds: first ejection time
+
+        Returns:
+            EgressPool
+        """
+        endpoints = []
+        for item in spec.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            proxy, _, concurrency = item.partition('*')
+            try:
+                concurrency = int(concurrency) if concurrency else DEFAULT_CONCURRENCY
+            except ValueError:
+                raise ValueError("bad concurrency in egress endpoint {}".format(item))
+            if concurrency < 1:
+                raise ValueError("bad concurrency in egress endpoint {}".format(item))
+            if proxy == DIRECT:
+                proxy = None
+            elif not proxy.startswith('http://'):
+                raise ValueError("unsupport egress endpoint {}, use http://host:port or {}".format(
+                    item, DIRECT))
+            endpoints.append(Endpoint(proxy, concurrency))
+        return cls(endpoints, session, eject_seconds)
+
+    def acquire(self, tried=()):
+        """
+        wait for a free slot and reserve it, endpoints already tried
+        for this request are used last
+
+        Args:
+            tried: endpoints which failed this request
+
+        Returns:
+            Endpoint
+        """
+        with self.cond:
+            while True:
+                now = time.time()
+                free = [endpoint for endpoint in self.endpoints
+                        if endpoint.in_flight < endpoint.limit(now)]
+                if free:
+                    endpoint = min(free, key=lambda item: (
+                        item in tried, item.load(), item.score()))
+                    endpoint.in_flight += 1
+                    return endpoint
+                # all busy: wait for a release, all ejected: wait for re-admission
+                readmit = min(endpoint.ejected_until for endpoint in self.endpoints)
+                self.cond.wait(max(readmit - now, 0.01) if readmit > now else None)
+
+    def release(self, endpoint, latency, ok):
+        """
+        free a slot and update health of the endpoint
+
+        Args:
+            endpoint: Endpoint from acquire()
+            latency: request time in seconds
+            ok: whether the endpoint served the request, None if
+                the outcome says nothing about the endpoint
+        """
+        with self.cond:
+            endpoint.in_flight -= 1
+            if ok is None:
+                self.cond.notify_all()
+                return
+            endpoint.num_requests += 1
+            endpoint.error_rate = (1 - DECAY) * endpoint.error_rate + DECAY * (0.0 if ok else 1.0)
+            if ok:
+                endpoint.latency = latency if endpoint.latency is None else \
+                    (1 - DECAY) * endpoint.latency + DECAY * latency
+                endpoint.failures = 0
+                if endpoint.probation:
+                    endpoint.probation = False
+                    endpoint.ejections = 0
+                    endpoint.error_rate = 0.0
+            elif time.time() >= endpoint.ejected_until:
+                # failures of requests sent before an ejection do not count again
+                endpoint.num_errors += 1
+                endpoint.failures += 1
+                if endpoint.probation or endpoint.failures >= MAX_FAILURES or \
+                        endpoint.error_rate > MAX_ERROR_RATE:
+                    self._eject(endpoint)
+            self.cond.notify_all()
+
+    def _eject(self, endpoint):
+        endpoint.ejections += 1
+        seconds = min(self.eject_seconds * 2 ** (endpoint.ejections - 1), MAX_EJECT_SECONDS)
+        endpoint.ejected_until = time.time() + seconds
+        endpoint.probation = True
+        endpoint.failures = 0
+        print("egress {} ejected for {:g} seconds".format(endpoint.name(), seconds))
+        self.session.close_proxy(endpoint.proxy)
+
+    def fetch(self, url):
+        """
+        fetch url through the pool, failures of an endpoint are
+        retried on another one
+
+        Args:
+            url: page url
+
+        Returns:
+            page content (bytes)
+        """
+        tried = []
+        for attempt in range(MAX_ATTEMPTS):
+            endpoint = self.acquire(tried)
+            start = time.time()
+            # other errors (e.g. a bad Content-Encoding) say nothing
+            # about the endpoint, but its slot is released all the same
+            ok = None
+            try:
+                page = self.session.fetch(url, endpoint.proxy)
+                ok = True
+                return page
+            except urllib.error.HTTPError as e:
+                ok = e.code not in RETRY_CODES
+                if ok or attempt == MAX_ATTEMPTS - 1:
+                    raise
+            except (OSError, http.client.HTTPException):
+                ok = False
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+            finally:
+                self.release(endpoint, time.time() - start, ok)
+            tried.append(endpoint)
+
+    def stats(self):
+        """
+        health of every endpoint
+
+        Returns:
+            list of dictionaries
+        """
+        with self.cond:
+            now = time.time()
+            return [{'endpoint': endpoint.name(),
+                     'requests': endpoint.num_requests,
+                     'errors': endpoint.num_errors,
+                     'latency': endpoint.latency,
+                     'error_rate': endpoint.error_rate,
+                     'ejected': now < endpoint.ejected_until}
+                    for endpoint in self.endpoints]
+
+    def print_stats(self):
+        """print health of every endpoint"""
+        for item in self.stats():
+            latency = "{:.3f}s".format(item['latency']) if item['latency'] is not None else '-'
+            print("egress {}: {:d} requests, {:d} errors, latency {}, error rate {:.2f}{}".format(
+                item['endpoint'], item['requests'], item['errors'], latency,
+                item['error_rate'], ' (ejected)' if item['ejected'] else ''))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+egress pool example against local stand-in proxies: a fast one,
+a slow one and one failing its first requests
+"""
+
+# standard library
+import sys
+import time
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local library
+from http_session import HTTPSession
+from egress_pool import EgressPool
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    """stand-in for the site"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = "page {}".format(self.path).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def proxy_handler(delay, failures):
+    """handler class of a stand-in proxy"""
+    state = {'failures': failures}
+    lock = threading.Lock()
+    # the stand-in proxy talks to the origin directly
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+    class ProxyHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(delay)
+            with lock:
+                fail = state['failures'] > 0
+                state['failures'] -= 1
+            if fail:
+                self.send_response(502)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            with opener.open(self.path) as response:
+                body = response.read()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return ProxyHandler
+
+
+def start_server(handler):
+    """start a server on a free local port, return its url"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{:d}".format(server.server_address[1])
+
+
+def main():
+    """fetch pages through three stand-in proxies and print their health"""
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    origin = start_server(OriginHandler)
+    proxies = [start_server(proxy_handler(0.005, 0)),
+               start_server(proxy_handler(0.05, 0)),
+               start_server(proxy_handler(0.005, 5))]
+    spec = ','.join(proxy + '*4' for proxy in proxies)
+    # short ejection, so re-admission of the failing proxy is seen
+    pool = EgressPool.from_spec(spec, HTTPSession(), eject_seconds=0.2)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        pages = list(executor.map(
+            pool.fetch, ["{}/page/{:d}".format(origin, i) for i in range(num_pages)]))
+    assert all(page == "page /page/{:d}".format(i).encode('utf-8')
+               for i, page in enumerate(pages))
+    print("{:d} pages in {:.2f} seconds".format(len(pages), time.time() - start))
+    pool.print_stats()
+
+
+if __name__ == "__main__":
+    main()
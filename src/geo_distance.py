@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module computes distance from any origin zip code to the
+seller of every listing without crawling again
+
+It needs a zip code centroid table, either a csv file with
+zip,lat,lon columns or the US Census ZCTA gazetteer file
+(https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html)
+saved as src/zip_centroids.csv (or src/zip_centroids.txt).
+"""
+
+# standard library
+import os
+import sys
+
+# third party library
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 3958.8  # miles
+NUM_ZIPS = 100000
+_centroids = {}
+
+
+def load_zip_centroids(data_file=None):
+    """
+    load zip centroid table into dense arrays indexed by zip code
+
+    Args:
+        data_file: csv (zip,lat,lon) or gazetteer file, default is
+                   zip_centroids.csv (or .txt) next to this module
+
+    Returns:
+        (lat, lon): arrays of length 100000, NaN for unknown zip
+    """
+    if data_file is None:
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        data_file = os.path.join(dir_path, 'zip_centroids.csv')
+        if not os.path.exists(data_file):
+            data_file = os.path.join(dir_path, 'zip_centroids.txt')
+    if data_file in _centroids:
+        return _centroids[data_file]
+    if not os.path.exists(data_file):
+        print("{} does not exist, see geo_distance.py".format(data_file))
+        sys.exit(1)
+    table = pd.read_csv(data_file, sep=None, engine='python', dtype=str)
+    table.columns = [item.strip().lower() for item in table.columns]
+    # gazetteer column names
+    table = table.rename(columns={'geoid': 'zip', 'intptlat': 'lat', 'intptlong': 'lon'})
+    zips = pd.to_numeric(table['zip'], errors='coerce')
+    valid = zips.notnull() & (zips >= 0) & (zips < NUM_ZIPS)
+    lat = np.full(NUM_ZIPS, np.nan)
+    lon = np.full(NUM_ZIPS, np.nan)
+    index = zips[valid].astype(int).values
+    lat[index] = pd.to_numeric(table['lat'][valid], errors='coerce').values
+    lon[index] = pd.to_numeric(table['lon'][valid], errors='coerce').values
+    _centroids[data_file] = (lat, lon)
+    return lat, lon
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    great circle distance in miles, arguments are degrees and
+    can be numpy arrays
+
+    Returns:
+        distance in miles
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(item) for item in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def zip_to_index(zips):
+    """
+    convert zip codes (e.g. '53715', '53715-1234', 53715.0) to
+    integer index, -1 for invalid zip
+
+    Args:
+        zips: pandas Series
+
+    Returns:
+        numpy int array
+    """
+    zips = zips.astype(str).str.strip().str.split('.', n=1).str[0].str[:5]
+    zips = pd.to_numeric(zips, errors='coerce')
+    zips = zips.where((zips >= 0) & (zips < NUM_ZIPS))
+    return zips.fillna(-1).astype(int).values
+
+
+def distance_from_zip(df, origin_zip, data_file=None):
+    """
+    distance from origin zip code to seller of every listing
+
+    Args:
+        df: Data Frame with seller_zip column
+        origin_zip: origin zip code
+        data_file: zip centroid table, see load_zip_centroids()
+
+    Returns:
+        numpy array of miles, NaN if seller zip is unknown
+    """
+    lat, lon = load_zip_centroids(data_file)
+    origin = int(origin_zip)
+    if np.isnan(lat[origin]):
+        print("unknown zip code {}".format(origin_zip))
+        sys.exit(1)
+    if 'seller_zip' not in df.columns:
+        return np.full(len(df), np.nan)
+    index = zip_to_index(df['seller_zip'])
+    seller_lat = np.where(index >= 0, lat[index], np.nan)
+    seller_lon = np.where(index >= 0, lon[index], np.nan)
+    return haversine(lat[origin], lon[origin], seller_lat, seller_lon)
+
+
+def add_distance_column(df, origin_zip, data_file=None):
+    """
+    add a distance_from_<zip> column
+
+    Args:
+        df: Data Frame with seller_zip column
+        origin_zip: origin zip code
+        data_file: zip centroid table, see load_zip_centroids()
+
+    Returns:
+        name of the new column
+    """
+    column = 'distance_from_{}'.format(origin_zip)
+    df[column] = distance_from_zip(df, origin_zip, data_file)
+    return column
@@ -13,12 +13,23 @@ import sys
 import re
 import json
 import csv
+from collections import defaultdict
 from difflib import SequenceMatcher
 
 # local library
 from utility import write_cars_to_csv
 # from pprint import pprint
 
+# sort order name: (sortBy, order) parameters of cars.com search
+SORT_ORDERS = {
+    'price-lowest': ('price', 'ASC'),
+    'price-highest': ('price', 'DESC'),
+    'miles-lowest': ('mileage', 'ASC'),
+    'distance-nearest': ('distance', 'ASC'),
+    'year-newest': ('year', 'DESC'),
+    'year-oldest': ('year', 'ASC'),
+}
+
 
 def construct_maker_model_dict(data_file='model_codes_carscom.csv'):
     """
@@ -64,20 +75,32 @@ def print_maker_model_id():
                   (i, j, model['nm'], model['id']))
 
 
-def search_makerID_and_modelID(mk, md, car_json_file):
+def load_car_catalog(car_json_file):
     """
-    search maker id and model id
+    load the cars.com maker/model catalog
+
+    Args:
+        car_json_file: cars.com mk-md json file
+
+    Returns:
+        list of makers, each one contains its models
+    """
+    with open(car_json_file) as f:
+        data = json.load(f)
+    return data['all']
+
+
+def normalize_maker_model(mk, md):
+    """
+    apply some alias rules to maker and model strings
 
     Args:
         mk: maker string
         md: model string
-        car_json_file: cars.com mk-md json file
 
     Returns:
-        (mkid, mdid): maker id, model id
+        (mk, md): normalized (lower case) maker and model
     """
-    data = json.load(open(car_json_file))
-    data = data['all']
     mk = mk.lower()
     md = md.lower()
     # add some rules
@@ -100,6 +123,22 @@ def search_makerID_and_modelID(mk, md, car_json_file):
             md = "cr-z"
         if md == "hrv":
             md = "hr-v"
+    return mk, md
+
+
+def find_makerID_and_modelID(mk, md, data):
+    """
+    look up maker id and model id in a loaded catalog
+
+    Args:
+        mk: maker string
+        md: model string
+        data: catalog returned by load_car_catalog()
+
+    Returns:
+        (mkid, mdid): maker id, model id, None if not found
+    """
+    mk, md = normalize_maker_model(mk, md)
     mkid, mdid = None, None
     for i, maker in enumerate(data, 1):
         if maker['nm'].lower() == mk:
@@ -113,27 +152,45 @@ def search_makerID_and_modelID(mk, md, car_json_file):
                 if model_name == md.lower():
                     mdid = model['id']
                     return mkid, mdid
+    return mkid, mdid
+
+
+def search_makerID_and_modelID(mk, md, car_json_file):
+    """
+    search maker id and model id
+
+    Args:
+        mk: maker string
+        md: model string
+        car_json_file: cars.com mk-md json file
+
+    Returns:
+        (mkid, mdid): maker id, model id
+    """
+    data = load_car_catalog(car_json_file)
+    mkid, mdid = find_makerID_and_modelID(mk, md, data)
+    mk, md = normalize_maker_model(mk, md)
     if not mkid:
         print("invalid maker name {}".format(mk))
         sys.exit(1)
     elif not mdid:
         print("invalid model name {}".format(md))
         sys.exit(1)
-    return None, None
+    return mkid, mdid
 
 
-def generate_url(maker, model, zipcode, radius, car_json_file,
-                 condition="new", page_num=1, num_per_page=100):
+def build_url(mkid, mdid, zipcode, radius,
+              condition="new", page_num=1, num_per_page=100, sort=None):
     """
-    generate url according to search query
+    build search url from cars.com maker id and model id
 
     Args:
-        maker: maker string
-        model: model string
+        mkid: maker id
+        mdid: model id
         zipcode: zipcode (int)
         radius: radius (int)
-        cat_json_file: cars.com mk-md json file
         condition: condition
+        sort: one of SORT_ORDERS, default is site relevance
 
     Returns:
         url
@@ -148,24 +205,45 @@ def generate_url(maker, model, zipcode, radius, car_json_file,
         choose_all = True
     if choose_all:
         template_url = "https://www.cars.com/for-sale/searchresults.action/?mkId=%s&mdId=%s&page=%d&perPage=%d&rd=%d&zc=%d&searchSource=QUICK_FORM"
+        url = template_url % (mkid, mdid, page_num,
+                              num_per_page, int(radius), zipcode)
     else:
         template_url = "https://www.cars.com/for-sale/searchresults.action/?mkId=%s&mdId=%s&page=%d&perPage=%d&rd=%d&zc=%d&stkTypId=%d&searchSource=QUICK_FORM"
-    mkid, mdid = search_makerID_and_modelID(maker, model, car_json_file)
-    if mkid and mdid:
-        if choose_all:
-            url = template_url % (mkid, mdid, page_num,
-                                  num_per_page, int(radius), zipcode)
-        else:
-            url = template_url % (mkid,
-                                  mdid,
-                                  page_num,
-                                  num_per_page,
-                                  int(radius),
-                                  zipcode,
-                                  new_used_code)
+        url = template_url % (mkid,
+                              mdid,
+                              page_num,
+                              num_per_page,
+                              int(radius),
+                              zipcode,
+                              new_used_code)
+    if sort is not None:
+        sort_by, order = SORT_ORDERS[sort]
+        url += "&sortBy=%s&order=%s" % (sort_by, order)
     return url
 
 
+def generate_url(maker, model, zipcode, radius, car_json_file,
+                 condition="new", page_num=1, num_per_page=100, sort=None):
+    """
+    generate url according to search query
+
+    Args:
+        maker: maker string
+        model: model string
+        zipcode: zipcode (int)
+        radius: radius (int)
+        cat_json_file: cars.com mk-md json file
+        condition: condition
+        sort: one of SORT_ORDERS, default is site relevance
+
+    Returns:
+        url
+    """
+    mkid, mdid = search_makerID_and_modelID(maker, model, car_json_file)
+    return build_url(mkid, mdid, zipcode, radius,
+                     condition, page_num, num_per_page, sort)
+
+
 def test():
     """test generate_url"""
     maker = 'Audi'
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module finds listings of the same physical car (reposted by
+several dealers or slightly edited) even without a usable VIN
+
+Every listing is turned into a set of tokens (name words, rounded
+miles and price, colors, seller). MinHash signatures of the token
+sets are split into LSH bands, listings sharing a band bucket are
+candidates, candidates with high estimated Jaccard similarity (or
+the same VIN) end up in the same cluster.
+"""
+
+# standard library
+import sys
+
+# third party library
+import numpy as np
+import pandas as pd
+
+# local library
+from data_analysis import load_csvfile, concat_compact
+
+NUM_BANDS = 32
+ROWS_PER_BAND = 4
+THRESHOLD = 0.7         # estimated Jaccard similarity of duplicates
+MAX_BUCKET = 200        # larger buckets are common tokens, not duplicates
+PRIME = (1 << 31) - 1
+
+
+def field_hash(values, field):
+    """
+    32 bit hashes of values, the same value in different fields
+    gets different hashes
+
+    Args:
+        values: pandas Series
+        field: field name
+
+    Returns:
+        numpy int64 array
+    """
+    hash_key = (field * 16)[:16]
+    hashes = pd.util.hash_array(values.astype(str).values, hash_key=hash_key)
+    return (hashes & np.uint64(0xffffffff)).astype(np.int64)
+
+
+def listing_tokens(df):
+    """
+    token hashes of every listing
+
+    Args:
+        df: Data Frame crawled from cars.com
+
+    Returns:
+        (row index, 32 bit token hash) arrays sorted by row
+    """
+    df = df.reset_index(drop=True)
+
+    def text(column):
+        if column not in df.columns:
+            return pd.Series('', index=df.index)
+        return df[column].astype(str).str.lower().str.strip()
+
+    def rounded(column, step):
+        values = pd.to_numeric(df[column], errors='coerce') if column in df.columns \
+            else pd.Series(np.nan, index=df.index)
+        return '/' + (values // step).astype(str)
+
+    paint = text('Exterior Color') + '/' + text('Interior Color') + '/' + text('color')
+    # (field, values, weight), a weight k field adds k tokens. Miles and
+    # price are combined with paint, so cars of the same model with
+    # different colors share only the name and drivetrain tokens
+    fields = [
+        ('paint', paint, 1),
+        ('seller', text('seller_name'), 1),
+        ('trans', text('Transmission'), 1),
+        ('drive', text('Drivetrain'), 1),
+        # two resolutions, so small edits keep one of them
+        ('miles1k', paint + rounded('miles', 1000), 3),
+        ('miles5k', paint + rounded('miles', 5000), 3),
+        ('price500', paint + rounded('price', 500), 2),
+        ('price2k', paint + rounded('price', 2000), 2),
+    ]
+    rows = []
+    hashes = []
+    for field, values, weight in fields:
+        for k in range(weight):
+            rows.append(np.arange(len(df)))
+            hashes.append(field_hash(values, field + str(k)))
+    # name words, e.g. '2018', 'audi', 'q3', '2.0t', 'premium', 'plus'
+    words = text('name').str.split().explode()
+    words = words[words.notnull()]
+    rows.append(words.index.values)
+    hashes.append(field_hash(words, 'name'))
+    row = np.concatenate(rows)
+    token = np.concatenate(hashes)
+    order = np.argsort(row, kind='stable')
+    return row[order], token[order]
+
+
+def minhash_signatures(df, num_perm=NUM_BANDS * ROWS_PER_BAND, seed=0):
+    """
+    MinHash signature of every listing
+
+    Args:
+        df: Data Frame crawled from cars.com
+        num_perm: number of hash functions
+        seed: random seed of hash functions
+
+    Returns:
+        (n, num_perm) int32 array
+    """
+    row, token = listing_tokens(df)
+    starts = np.flatnonzero(np.r_[True, row[1:] != row[:-1]])
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, PRIME, num_perm).astype(np.int64)
+    b = rng.randint(0, PRIME, num_perm).astype(np.int64)
+    signatures = np.full((len(df), num_perm), PRIME, dtype=np.int32)
+    token = token % PRIME
+    for i in range(num_perm):
+        # (a * x + b) mod p fits int64 because a, x < 2^31
+        values = (a[i] * token + b[i]) % PRIME
+        signatures[row[starts], i] = np.minimum.reduceat(values, starts)
+    return signatures
+
+
+def candidate_pairs(signatures, num_bands=NUM_BANDS, rows_per_band=ROWS_PER_BAND):
+    """
+    pairs of listings sharing at least one LSH bucket, every member
+    of a bucket is paired with the first member
+
+    Args:
+        signatures: (n, num_bands * rows_per_band) MinHash signatures
+
+    Returns:
+        (left, right) index arrays
+    """
+    lefts, rights = [], []
+    for band in range(num_bands):
+        part = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        keys = pd.util.hash_pandas_object(pd.DataFrame(part), index=False).values
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        is_start = np.r_[True, keys[1:] != keys[:-1]]
+        bucket = np.cumsum(is_start) - 1
+        starts = np.flatnonzero(is_start)
+        sizes = np.diff(np.r_[starts, len(keys)])
+        member = ~is_start & (sizes[bucket] <= MAX_BUCKET)
+        lefts.append(order[starts[bucket[member]]])
+        rights.append(order[member])
+    left, right = np.concatenate(lefts), np.concatenate(rights)
+    pairs = np.unique(np.column_stack([left, right]), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def estimate_similarity(signatures, left, right, chunk=100000):
+    """
+    estimated Jaccard similarity of pairs, computed in chunks
+    to bound memory
+
+    Args:
+        signatures: (n, num_perm) MinHash signatures
+        left: pair start array
+        right: pair end array
+
+    Returns:
+        similarity array
+    """
+    similarity = np.empty(len(left))
+    for start in range(0, len(left), chunk):
+        stop = start + chunk
+        similarity[start:stop] = (signatures[left[start:stop]] ==
+                                  signatures[right[start:stop]]).mean(axis=1)
+    return similarity
+
+
+def connected_components(n, left, right):
+    """
+    label connected components of a graph by min label propagation
+
+    Args:
+        n: number of nodes
+        left: edge start array
+        right: edge end array
+
+    Returns:
+        labels array, smallest node index of each component
+    """
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[left], labels[right])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, left, low)
+        np.minimum.at(new_labels, right, low)
+        # pointer jumping
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def valid_vins(df):
+    """
+    VIN codes of listings
+
+    Args:
+        df: Data Frame crawled from cars.com
+
+    Returns:
+        numpy int array, same code for same VIN, -1 for missing or bad VIN
+    """
+    if 'VIN' not in df.columns:
+        return np.full(len(df), -1)
+    vin = df['VIN'].astype(str).str.strip().str.upper()
+    valid = vin.str.fullmatch(r'[A-HJ-NPR-Z0-9]{17}').values
+    codes = np.full(len(df), -1)
+    codes[valid] = pd.factorize(vin.values[valid])[0]
+    return codes
+
+
+def near_duplicate_clusters(df, threshold=THRESHOLD):
+    """
+    cluster id of every listing, listings of the same car share an id
+
+    Listings with a valid VIN are clustered by VIN. Listings without one
+    are clustered with each other, then every such cluster joins the VIN
+    cluster it is most similar to (if any), so two different VINs never
+    end up in one cluster.
+
+    Args:
+        df: Data Frame crawled from cars.com
+        threshold: estimated Jaccard similarity of duplicates
+
+    Returns:
+        numpy int array of cluster ids
+    """
+    n = len(df)
+    vin = valid_vins(df)
+    num_vins = vin.max() + 1
+    signatures = minhash_signatures(df)
+    left, right = candidate_pairs(signatures)
+    similarity = estimate_similarity(signatures, left, right)
+    keep = similarity >= threshold
+    left, right, similarity = left[keep], right[keep], similarity[keep]
+    # 1. listings without VIN
+    no_vin = (vin[left] < 0) & (vin[right] < 0)
+    component = connected_components(n, left[no_vin], right[no_vin])
+    labels = np.where(vin >= 0, vin, num_vins + component)
+    # 2. attach to the most similar VIN cluster
+    cross = (vin[left] < 0) != (vin[right] < 0)
+    left, right, similarity = left[cross], right[cross], similarity[cross]
+    inner = np.where(vin[left] < 0, left, right)
+    outer = np.where(vin[left] < 0, right, left)
+    order = np.lexsort((-similarity, component[inner]))
+    best = order[np.r_[True, component[inner][order][1:] != component[inner][order][:-1]]] \
+        if len(order) else order
+    target = np.arange(n + num_vins)
+    target[num_vins + component[inner[best]]] = vin[outer[best]]
+    return pd.factorize(target[labels])[0]
+
+
+def drop_near_duplicates(df, threshold=THRESHOLD):
+    """
+    keep the first listing of every cluster, e.g. before analyze_price()
+
+    Args:
+        df: Data Frame crawled from cars.com
+        threshold: estimated Jaccard similarity of duplicates
+
+    Returns:
+        new Data Frame
+    """
+    cluster_id = near_duplicate_clusters(df, threshold)
+    return df[~pd.Series(cluster_id, index=df.index).duplicated()]
+
+
+def main():
+    """add cluster_id column to crawled csv files"""
+    if len(sys.argv) < 3:
+        print(
+            "Usage: >> python {} <output_csv> <csvfile> ...".format(sys.argv[0]))
+        sys.exit(1)
+    output_csv, csv_names = sys.argv[1], sys.argv[2:]
+    df = concat_compact([load_csvfile(csv_name, compact=True) for csv_name in csv_names])
+    df['cluster_id'] = near_duplicate_clusters(df)
+    num_clusters = df['cluster_id'].nunique()
+    print("{:d} listings, {:d} clusters, {:d} duplicates".format(
+        len(df), num_clusters, len(df) - num_clusters))
+    df.to_csv(output_csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
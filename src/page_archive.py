@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module contains an append-only archive of raw result pages
+
+The data file (<name>.warc.gz) is a sequence of gzip members, one
+WARC-like record per member, so it can also be read by gunzip.
+The index file (<name>.idx) stores (offset, length, timestamp) of
+every record in fixed size binary rows and is memory mapped for
+random access.
+"""
+
+# standard library
+import os
+import gzip
+import mmap
+import time
+import struct
+import threading
+
+INDEX_ROW = struct.Struct('<QQQ')  # offset, length, timestamp
+
+
+class PageArchive:
+    """append-only archive of (url, page) records"""
+
+    def __init__(self, path):
+        """
+        open (or create) an archive
+
+        Args:
+            path: archive name without extension
+        """
+        self.data_file = path + '.warc.gz'
+        self.index_file = path + '.idx'
+        self.lock = threading.Lock()
+        self.data = open(self.data_file, 'ab')
+        self.index = open(self.index_file, 'ab')
+        # drop a partially written index row left by a crash
+        size = os.path.getsize(self.index_file)
+        if size % INDEX_ROW.size:
+            self.index.truncate(size - size % INDEX_ROW.size)
+
+    def append(self, url, page, timestamp=None):
+        """
+        append one page to the archive
+
+        Args:
+            url: url of the page
+            page: page content (bytes)
+            timestamp: fetch time in seconds, default is now
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        header = ("WARC/1.0\r\n"
+                  "WARC-Type: response\r\n"
+                  "WARC-Target-URI: {}\r\n"
+                  "WARC-Date: {}\r\n"
+                  "Content-Length: {:d}\r\n\r\n").format(
+                      url,
+                      time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp)),
+                      len(page))
+        record = gzip.compress(header.encode('utf-8') + page + b'\r\n\r\n')
+        with self.lock:
+            offset = self.data.seek(0, os.SEEK_END)
+            self.data.write(record)
+            self.data.flush()
+            # index row is written after the data, so it never points
+            # to a missing record
+            self.index.write(INDEX_ROW.pack(offset, len(record), timestamp))
+            self.index.flush()
+
+    def close(self):
+        """close archive files"""
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parse_record(record):
+    """
+    parse a decompressed archive record
+
+    Args:
+        record: bytes of one record
+
+    Returns:
+        (url, page)
+    """
+    header, _, body = record.partition(b'\r\n\r\n')
+    url = None
+    length = len(body)
+    for line in header.decode('utf-8').split('\r\n'):
+        key, _, value = line.partition(': ')
+        if key == 'WARC-Target-URI':
+            url = value
+        elif key == 'Content-Length':
+            length = int(value)
+    return url, body[:length]
+
+
+def count_records(path):
+    """
+    number of records in an archive
+
+    Args:
+        path: archive name without extension
+
+    Returns:
+        number of records
+    """
+    return os.path.getsize(path + '.idx') // INDEX_ROW.size
+
+
+def read_records(path, start=0, stop=None):
+    """
+    read records [start, stop) of an archive
+
+    Args:
+        path: archive name without extension
+        start: first record
+        stop: one past the last record, default is the end
+
+    Yields:
+        (url, page, timestamp)
+    """
+    num_records = count_records(path)
+    if stop is None or stop > num_records:
+        stop = num_records
+    if start >= stop:
+        return
+    with open(path + '.idx', 'rb') as idxf, open(path + '.warc.gz', 'rb') as dataf:
+        with mmap.mmap(idxf.fileno(), 0, access=mmap.ACCESS_READ) as index, \
+                mmap.mmap(dataf.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for i in range(start, stop):
+                offset, length, timestamp = INDEX_ROW.unpack_from(
+                    index, i * INDEX_ROW.size)
+                url, page = parse_record(gzip.decompress(data[offset:offset + length]))
+                yield url, page, timestamp
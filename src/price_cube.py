@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module contains a precomputed price cube keyed by
+maker x model x condition x year x zip region
+
+Every cell holds mergeable summaries (count, sum, sum of squares,
+min, max and a log-bucket quantile sketch). Cells with year '*'
+and region '*' are kept up to date as well, so every query is a
+single dictionary lookup. The cells of every search are kept too,
+so a new crawl of a search replaces its old listings.
+"""
+
+# standard library
+import os
+import sys
+import math
+import json
+
+# third party library
+import numpy as np
+import pandas as pd
+
+# local library
+from utility import parse_csv_name
+from handle_search_carscom import load_car_catalog
+from data_analysis import load_csvfile, add_year_column, print_price_info
+
+ALPHA = 0.01  # relative accuracy of quantiles
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+ANY = '*'
+
+
+def zip_region(zipcode):
+    """first three digits of a zip code"""
+    return "{:05d}".format(int(zipcode))[:3]
+
+
+def cell_key(maker, model, condition, year=ANY, region=ANY):
+    """key of a cube cell"""
+    return '|'.join(str(item).upper() for item in
+                    (maker, model, condition, year, region))
+
+
+def new_cell():
+    """empty cell"""
+    return {'count': 0, 'sum': 0.0, 'sumsq': 0.0,
+            'min': math.inf, 'max': -math.inf, 'sketch': {}}
+
+
+def merge_cell(cell, other):
+    """
+    merge summaries of other into cell (in place)
+
+    Args:
+        cell: cube cell
+        other: cube cell
+    """
+    cell['count'] += other['count']
+    cell['sum'] += other['sum']
+    cell['sumsq'] += other['sumsq']
+    cell['min'] = min(cell['min'], other['min'])
+    cell['max'] = max(cell['max'], other['max'])
+    sketch = cell['sketch']
+    for bucket, count in other['sketch'].items():
+        sketch[bucket] = sketch.get(bucket, 0) + count
+
+
+def sketch_quantile(sketch, count, q):
+    """
+    quantile estimated from a log-bucket sketch
+
+    Args:
+        sketch: dictionary bucket -> count
+        count: number of values
+        q: quantile in [0, 1]
+
+    Returns:
+        value with relative error ALPHA
+    """
+    rank = q * (count - 1)
+    seen = 0
+    for bucket in sorted(sketch, key=int):
+        seen += sketch[bucket]
+        if seen > rank:
+            return 2 * GAMMA ** int(bucket) / (GAMMA + 1)
+    return math.nan
+
+
+def cell_price_info(cell):
+    """
+    convert a cell to the price_info used by print_price_info()
+    and plot_price_info()
+
+    Args:
+        cell: cube cell
+
+    Returns:
+        price_info: a dictionary
+    """
+    n = cell['count']
+    mean = cell['sum'] / n
+    var = max(0.0, (cell['sumsq'] - n * mean * mean) / (n - 1)) if n > 1 else math.nan
+    price_info = {'count': n, 'mean': mean, 'std': math.sqrt(var),
+                  'min': cell['min'], 'max': cell['max']}
+    for name, q in (('25%', 0.25), ('50%', 0.5), ('75%', 0.75)):
+        price_info[name] = min(max(sketch_quantile(cell['sketch'], n, q),
+                                   cell['min']), cell['max'])
+    price_info['median'] = price_info['50%']
+    return price_info
+
+
+def summarize(df, by):
+    """
+    cells of a Data Frame grouped by columns
+
+    Args:
+        df: Data Frame with price and grouping columns
+        by: list of grouping columns
+
+    Returns:
+        dictionary group value -> cell
+    """
+    cells = {}
+    price = df['price']
+    grouped = price.groupby([df[item] for item in by])
+    stats = pd.DataFrame({'count': grouped.count(), 'sum': grouped.sum(),
+                          'sumsq': (price ** 2).groupby([df[item] for item in by]).sum(),
+                          'min': grouped.min(), 'max': grouped.max()})
+    buckets = np.ceil(np.log(price) / math.log(GAMMA)).astype(int)
+    sketches = buckets.groupby([df[item] for item in by] + [buckets]).size()
+    for group, row in stats.iterrows():
+        cell = new_cell()
+        cell.update({'count': int(row['count']), 'sum': float(row['sum']),
+                     'sumsq': float(row['sumsq']), 'min': float(row['min']),
+                     'max': float(row['max'])})
+        cells[group if isinstance(group, tuple) else (group,)] = cell
+    for group, count in sketches.items():
+        cells[group[:-1]]['sketch'][str(group[-1])] = int(count)
+    return cells
+
+
+class PriceCube:
+    """price cube stored in a json file"""
+
+    def __init__(self, cube_file):
+        """
+        Args:
+            cube_file: json filename, created on save()
+        """
+        self.cube_file = cube_file
+        self.cells = {}
+        # cells of every source (one per search), so that a new crawl
+        # of a search replaces the old one instead of adding to it
+        self.sources = {}
+        if os.path.exists(cube_file):
+            with open(cube_file, 'r') as f:
+                data = json.load(f)
+            self.cells = data['cells']
+            self.sources = data['sources']
+
+    def save(self):
+        """write cube to json file"""
+        with open(self.cube_file + '.tmp', 'w') as f:
+            json.dump({'cells': self.cells, 'sources': self.sources}, f)
+        os.replace(self.cube_file + '.tmp', self.cube_file)
+
+    def _rebuild(self, key):
+        """merge one cell from all sources"""
+        cell = new_cell()
+        for source_cells in self.sources.values():
+            if key in source_cells:
+                merge_cell(cell, source_cells[key])
+        if cell['count']:
+            self.cells[key] = cell
+        else:
+            self.cells.pop(key, None)
+
+    def update(self, df, maker, model, condition, zipcode, source):
+        """
+        add listings of one crawl to the cube, listings added before
+        with the same source are replaced
+
+        Args:
+            df: Data Frame crawled from cars.com
+            maker: maker string
+            model: model string
+            condition: new, used or all
+            zipcode: zip code of the search
+            source: name of the search, e.g. the csv filename
+        """
+        df = df[np.isfinite(df['price'])]
+        df = df[df['price'] > 0].copy()
+        if 'VIN' in df.columns:
+            # a car listed twice in one crawl is counted once
+            df = df[df['VIN'].isnull() | ~df['VIN'].duplicated()]
+        source_cells = {}
+        if not df.empty:
+            add_year_column(df)
+            df['price'] = df['price'].astype(float)
+            region = zip_region(zipcode)
+            by_year = summarize(df, ['year'])
+            for (year,), cell in by_year.items():
+                for key_year in (year, ANY):
+                    for key_region in (region, ANY):
+                        key = cell_key(maker, model, condition, key_year, key_region)
+                        merge_cell(source_cells.setdefault(key, new_cell()), cell)
+        old_cells = self.sources.pop(source, {})
+        if source_cells:
+            self.sources[source] = source_cells
+        for key in set(old_cells) | set(source_cells):
+            self._rebuild(key)
+
+    def query(self, maker, model, condition, year=ANY, zipcode=None):
+        """
+        price info of a cell in constant time
+
+        Args:
+            maker: maker string
+            model: model string
+            condition: new, used or all
+            year: model year, default is all years
+            zipcode: any zip code of the region, default is all regions
+
+        Returns:
+            price_info dictionary or None if the cell is empty
+        """
+        region = ANY if zipcode is None else zip_region(zipcode)
+        cell = self.cells.get(cell_key(maker, model, condition, year, region))
+        if cell is None or cell['count'] == 0:
+            return None
+        return cell_price_info(cell)
+
+
+def main():
+    """update cube with crawled csv files or query it"""
+    usage = ("Usage: >> python {0} update <cube_file> <json or keyfile> <csvfile> ...\n"
+             "       >> python {0} query <cube_file> <maker> <model> <used or new> [year or *] [zip]").format(sys.argv[0])
+    if len(sys.argv) < 4 or sys.argv[1] not in ('update', 'query') or \
+            (sys.argv[1] == 'update' and len(sys.argv) < 5):
+        print(usage)
+        sys.exit(1)
+    cube = PriceCube(sys.argv[2])
+    if sys.argv[1] == 'update':
+        makers = [maker['nm'].lower() for maker in load_car_catalog(sys.argv[3])]
+        for csv_name in sys.argv[4:]:
+            maker, model, zipcode, condition = parse_csv_name(csv_name, makers)
+            cube.update(load_csvfile(csv_name), maker, model, condition, zipcode,
+                        os.path.basename(csv_name))
+        cube.save()
+    elif len(sys.argv) in (6, 7, 8):
+        maker, model, condition = sys.argv[3:6]
+        year = sys.argv[6] if len(sys.argv) > 6 else ANY
+        zipcode = sys.argv[7] if len(sys.argv) > 7 else None
+        price_info = cube.query(maker, model, condition, year, zipcode)
+        if price_info is None:
+            print("no data for {} {} {}".format(maker, model, condition))
+            sys.exit(1)
+        print_price_info(price_info, {'maker': maker.upper(), 'model': model.upper(),
+                                      'condition': condition.upper()})
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module contains a per-VIN price history store
+
+Every ingested crawl is appended as a small columnar segment
+(vin id, price, miles, seller id, one timestamp per crawl).
+compact() merges segments into one base file sorted by
+(vin id, timestamp) with delta encoded timestamps and an
+offsets array, so the observations of VIN i are
+base[offsets[i]:offsets[i + 1]].
+"""
+
+# standard library
+import os
+import sys
+import glob
+import json
+import time
+
+# third party library
+import numpy as np
+import pandas as pd
+
+# local library
+from data_analysis import load_csvfile
+
+
+class PriceHistory:
+    """columnar store of (VIN, timestamp, price, miles, seller)"""
+
+    def __init__(self, store_dir):
+        """
+        open (or create) a store
+
+        Args:
+            store_dir: directory of the store
+        """
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.vins = self._load_names('vins.json')
+        self.sellers = self._load_names('sellers.json')
+        self.vin_ids = {vin: i for i, vin in enumerate(self.vins)}
+        self.seller_ids = {seller: i for i, seller in enumerate(self.sellers)}
+        self._columns = None
+
+    def _load_names(self, name):
+        filename = os.path.join(self.store_dir, name)
+        if not os.path.exists(filename):
+            return []
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    def _save_names(self):
+        for name, names in (('vins.json', self.vins), ('sellers.json', self.sellers)):
+            filename = os.path.join(self.store_dir, name)
+            with open(filename + '.tmp', 'w') as f:
+                json.dump(names, f)
+            os.replace(filename + '.tmp', filename)
+
+    @staticmethod
+    def _encode(values, names, ids):
+        """map strings to integer ids, new strings get new ids"""
+        codes, uniques = pd.factorize(values)
+        unique_ids = pd.Index(names, dtype=object).get_indexer(uniques)
+        new = unique_ids < 0
+        unique_ids[new] = len(names) + np.arange(new.sum())
+        new_names = list(uniques[new])
+        ids.update(zip(new_names, unique_ids[new].tolist()))
+        names.extend(new_names)
+        return unique_ids[codes].astype(np.int32)
+
+    def ingest(self, df, timestamp=None):
+        """
+        append observations of one crawl
+
+        Args:
+            df: Data Frame crawled from cars.com
+            timestamp: crawl time in seconds, default is now
+
+        Returns:
+            number of observations
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        df = df[df['VIN'].notnull()]
+        price = pd.to_numeric(df['price'], errors='coerce')
+        miles = pd.to_numeric(df['miles'], errors='coerce').fillna(-1)
+        vin_id = self._encode(df['VIN'].astype(str).str.strip().values,
+                              self.vins, self.vin_ids)
+        seller_id = self._encode(df['seller_name'].fillna('').astype(str).values,
+                                 self.sellers, self.seller_ids)
+        self._save_names()
+        segment = os.path.join(self.store_dir, 'seg-{:d}-{:d}.npz'.format(
+            int(timestamp), len(glob.glob(os.path.join(self.store_dir, 'seg-*.npz')))))
+        np.savez_compressed(segment,
+                            timestamp=np.int64(timestamp),
+                            vin_id=vin_id,
+                            price=price.values.astype(np.float32),
+                            miles=miles.values.astype(np.int32),
+                            seller_id=seller_id)
+        self._columns = None
+        return len(vin_id)
+
+    @staticmethod
+    def _sort_key(columns):
+        """(vin id, timestamp) packed in one int64"""
+        return (columns['vin_id'].astype(np.int64) << 32) | columns['timestamp']
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.store_dir, 'seg-*.npz')))
+
+    def _read_columns(self, segments):
+        """
+        read base file (already sorted) and merge the given segments
+        into it, sorted by (vin id, timestamp)
+        """
+        names = ('timestamp', 'vin_id', 'price', 'miles', 'seller_id')
+        dtypes = (np.int64, np.int32, np.float32, np.int32, np.int32)
+        columns = {name: np.empty(0, dtype=dtype) for name, dtype in zip(names, dtypes)}
+        offsets = None
+        base_file = os.path.join(self.store_dir, 'base.npz')
+        if os.path.exists(base_file):
+            with np.load(base_file) as base:
+                columns = {'timestamp': np.cumsum(base['timestamp_delta']),
+                           'vin_id': base['vin_id'],
+                           'price': base['price'],
+                           'miles': base['miles'],
+                           'seller_id': base['seller_id']}
+                offsets = base['offsets']
+        parts = []
+        for segment in segments:
+            with np.load(segment) as seg:
+                n = len(seg['vin_id'])
+                parts.append({'timestamp': np.full(n, seg['timestamp'], dtype=np.int64),
+                              'vin_id': seg['vin_id'],
+                              'price': seg['price'],
+                              'miles': seg['miles'],
+                              'seller_id': seg['seller_id']})
+        if parts:
+            new = {name: np.concatenate([part[name] for part in parts]) for name in names}
+            order = np.lexsort((new['timestamp'], new['vin_id']))
+            new = {name: values[order] for name, values in new.items()}
+            # merge sorted segment rows into the sorted base
+            positions = np.searchsorted(self._sort_key(columns), self._sort_key(new),
+                                        side='right') + \
+                np.arange(len(new['vin_id']))
+            is_new = np.zeros(len(columns['vin_id']) + len(new['vin_id']), dtype=bool)
+            is_new[positions] = True
+            merged = {}
+            for name in names:
+                values = np.empty(len(is_new), dtype=new[name].dtype)
+                values[is_new] = new[name]
+                values[~is_new] = columns[name]
+                merged[name] = values
+            columns = merged
+            offsets = None
+        num_vins = len(self.vins)
+        if offsets is None:
+            offsets = np.searchsorted(columns['vin_id'], np.arange(num_vins + 1))
+        elif len(offsets) < num_vins + 1:
+            # VINs added after the last compact have no observations yet
+            offsets = np.r_[offsets, np.full(num_vins + 1 - len(offsets), offsets[-1])]
+        columns['offsets'] = offsets.astype(np.int64)
+        return columns
+
+    def columns(self):
+        """
+        all observations sorted by (vin id, timestamp), with a
+        per-VIN offsets array
+
+        Returns:
+            dictionary of numpy arrays
+        """
+        if self._columns is None:
+            self._columns = self._read_columns(self._segments())
+        return self._columns
+
+    def compact(self):
+        """merge segments into the base file"""
+        # segments ingested after this glob are kept for the next compact
+        segments = self._segments()
+        columns = self._read_columns(segments)
+        base_file = os.path.join(self.store_dir, 'base.npz')
+        np.savez_compressed(base_file + '.tmp.npz',
+                            timestamp_delta=np.diff(columns['timestamp'], prepend=0),
+                            vin_id=columns['vin_id'],
+                            price=columns['price'],
+                            miles=columns['miles'],
+                            seller_id=columns['seller_id'],
+                            offsets=columns['offsets'])
+        os.replace(base_file + '.tmp.npz', base_file)
+        for segment in segments:
+            os.remove(segment)
+        self._columns = None
+
+    def vin_history(self, vin):
+        """
+        price history of one car
+
+        Args:
+            vin: VIN string
+
+        Returns:
+            Data Frame with timestamp, price, miles and seller_name
+        """
+        columns = self.columns()
+        if vin not in self.vin_ids:
+            return pd.DataFrame(columns=['timestamp', 'price', 'miles', 'seller_name'])
+        i = self.vin_ids[vin]
+        lo, hi = columns['offsets'][i], columns['offsets'][i + 1]
+        sellers = np.array(self.sellers, dtype=object)
+        return pd.DataFrame({'timestamp': columns['timestamp'][lo:hi],
+                             'price': columns['price'][lo:hi],
+                             'miles': columns['miles'][lo:hi],
+                             'seller_name': sellers[columns['seller_id'][lo:hi]]})
+
+    def _per_vin_range(self, start, end):
+        """
+        first and last observation index of every VIN in [start, end]
+
+        Returns:
+            (vin ids, first index, last index) of VINs seen in range
+        """
+        columns = self.columns()
+        ts = columns['timestamp']
+        index = np.flatnonzero((ts >= start) & (ts <= end))
+        if len(index) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        vin_id = columns['vin_id'][index]
+        # data are sorted by vin id, so every VIN is one run
+        is_first = np.r_[True, vin_id[1:] != vin_id[:-1]]
+        is_last = np.r_[vin_id[1:] != vin_id[:-1], True]
+        return vin_id[is_first], index[is_first], index[is_last]
+
+    def price_drops(self, start, end, threshold=0.05):
+        """
+        listings whose price dropped by at least threshold in [start, end]
+
+        Args:
+            start: start time in seconds
+            end: end time in seconds
+            threshold: relative drop, e.g. 0.05 means 5%
+
+        Returns:
+            Data Frame with VIN, first_price, last_price and drop
+        """
+        columns = self.columns()
+        vin_id, first, last = self._per_vin_range(start, end)
+        first_price = columns['price'][first]
+        last_price = columns['price'][last]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drop = (first_price - last_price) / first_price
+        mask = np.isfinite(drop) & (first_price > 0) & (drop >= threshold)
+        vins = np.array(self.vins, dtype=object)
+        df = pd.DataFrame({'VIN': vins[vin_id[mask]],
+                           'first_price': first_price[mask],
+                           'last_price': last_price[mask],
+                           'drop': drop[mask]})
+        return df.sort_values('drop', ascending=False)
+
+    def time_on_market(self, start=0, end=None):
+        """
+        time between first and last observation of every VIN
+
+        Args:
+            start: start time in seconds
+            end: end time in seconds, default is now
+
+        Returns:
+            Data Frame with VIN, first_seen, last_seen and days
+        """
+        if end is None:
+            end = int(time.time())
+        columns = self.columns()
+        vin_id, first, last = self._per_vin_range(start, end)
+        first_seen = columns['timestamp'][first]
+        last_seen = columns['timestamp'][last]
+        vins = np.array(self.vins, dtype=object)
+        return pd.DataFrame({'VIN': vins[vin_id],
+                             'first_seen': first_seen,
+                             'last_seen': last_seen,
+                             'days': (last_seen - first_seen) / 86400.0})
+
+
+def main():
+    """ingest csv files or query price drops"""
+    usage = ("Usage: >> python {0} ingest <store_dir> <csvfile> ...\n"
+             "       >> python {0} compact <store_dir>\n"
+             "       >> python {0} drops <store_dir> <days> <percent>").format(sys.argv[0])
+    if len(sys.argv) < 3:
+        print(usage)
+        sys.exit(1)
+    command, store_dir = sys.argv[1], sys.argv[2]
+    history = PriceHistory(store_dir)
+    if command == 'ingest' and len(sys.argv) > 3:
+        for csv_name in sys.argv[3:]:
+            df = load_csvfile(csv_name)
+            if 'crawl_time' in df.columns:
+                # reparsed archive, every page has its own fetch time
+                n = sum(history.ingest(group, int(timestamp))
+                        for timestamp, group in df.groupby('crawl_time'))
+            else:
+                # crawl time is the time the csv file was written
+                n = history.ingest(df, int(os.path.getmtime(csv_name)))
+            print("ingest {:d} observations from {}".format(n, csv_name))
+    elif command == 'compact':
+        history.compact()
+    elif command == 'drops' and len(sys.argv) == 5:
+        days, percent = float(sys.argv[3]), float(sys.argv[4])
+        end = int(time.time())
+        df = history.price_drops(end - days * 86400, end, percent / 100)
+        print(df.to_string(index=False))
+    else:
+        print(usage)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
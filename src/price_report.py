@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module renders price comparison charts of many models
+to image files without a display
+"""
+
+# standard library
+import os
+import sys
+import glob
+import json
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# local library
+from utility import parse_csv_name
+from handle_search_carscom import load_car_catalog
+from data_analysis import load_csvfile, analyze_price, draw_price_info
+
+INDEX_NAME = 'report-index.json'
+
+
+def group_price_infos(car_infos, price_infos, group_by='maker', per_page=12):
+    """
+    split car infos and price infos into pages, one group is
+    split into several pages if it has more than per_page models
+
+    Args:
+        car_infos: a list of dictionaries store car information
+        price_infos: a list of dictionaries store price information
+        group_by: 'maker', 'condition' or None
+        per_page: max number of models in one chart
+
+    Returns:
+        list of (page_name, car_infos, price_infos)
+    """
+    groups = OrderedDict()
+    for car_info, price_info in zip(car_infos, price_infos):
+        key = car_info[group_by] if group_by else 'all'
+        groups.setdefault(key, []).append((car_info, price_info))
+    pages = []
+    for key in sorted(groups):
+        items = sorted(groups[key], key=lambda item: item[0]['model'])
+        for start in range(0, len(items), per_page):
+            page_name = "{}-{:d}".format(key, start // per_page + 1)
+            page_name = page_name.replace('/', '_').replace(' ', '_')
+            chunk = items[start:start + per_page]
+            pages.append((page_name,
+                          [car_info for car_info, _ in chunk],
+                          [price_info for _, price_info in chunk]))
+    return pages
+
+
+def stats_digest(car_infos, price_infos):
+    """
+    hash the statistics drawn in a chart
+
+    Args:
+        car_infos: a list of dictionaries store car information
+        price_infos: a list of dictionaries store price information
+
+    Returns:
+        hex digest string
+    """
+    content = []
+    for car_info, price_info in zip(car_infos, price_infos):
+        stats = [round(float(price_info[key]), 2)
+                 for key in ('min', 'mean', 'max', 'std')]
+        content.append([car_info['maker'], car_info['model'],
+                        car_info['condition'], stats])
+    return hashlib.sha1(json.dumps(content).encode('utf-8')).hexdigest()
+
+
+def init_worker():
+    """use a non-interactive backend in worker process"""
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+
+def render_page(page):
+    """
+    render one chart to file
+
+    Args:
+        page: (title, car_infos, price_infos, filename)
+
+    Returns:
+        filename
+    """
+    import matplotlib.pyplot as plt
+    title, car_infos, price_infos, filename = page
+    width = max(8, 0.6 * len(car_infos))
+    fig, ax = plt.subplots(figsize=(width, 8))
+    draw_price_info(ax, car_infos, price_infos)
+    ax.set_title(title)
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
+
+def render_report(car_infos, price_infos, output_dir, group_by='maker',
+                  per_page=12, fmt='png', workers=None):
+    """
+    render price comparison charts in parallel, charts whose
+    statistics did not change since last run are skipped
+
+    Args:
+        car_infos: a list of dictionaries store car information
+        price_infos: a list of dictionaries store price information
+        output_dir: directory for charts
+        group_by: 'maker', 'condition' or None
+        per_page: max number of models in one chart
+        fmt: 'png' or 'svg'
+        workers: number of processes, default is number of cores
+
+    Returns:
+        (rendered, skipped): lists of filenames
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_file = os.path.join(output_dir, INDEX_NAME)
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+    todo = []
+    skipped = []
+    new_index = {}
+    for page_name, page_cars, page_prices in group_price_infos(
+            car_infos, price_infos, group_by, per_page):
+        filename = os.path.join(output_dir, "{}.{}".format(page_name, fmt))
+        digest = stats_digest(page_cars, page_prices)
+        new_index[os.path.basename(filename)] = digest
+        if index.get(os.path.basename(filename)) == digest and os.path.exists(filename):
+            skipped.append(filename)
+        else:
+            todo.append((page_name, page_cars, page_prices, filename))
+    rendered = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker) as executor:
+            rendered = list(executor.map(render_page, todo))
+    with open(index_file, 'w') as f:
+        json.dump(new_index, f, indent=2, sort_keys=True)
+    return rendered, skipped
+
+
+def load_price_infos(csv_dir, makers):
+    """
+    analyze every crawled csv file in a directory
+
+    Args:
+        csv_dir: directory of csv files
+        makers: lower case maker names of the catalog
+
+    Returns:
+        (car_infos, price_infos)
+    """
+    car_infos = []
+    price_infos = []
+    for csv_name in sorted(glob.glob(os.path.join(csv_dir, '*.csv'))):
+        df = load_csvfile(csv_name, compact=True, usecols=['price'])
+        price_info = analyze_price(df)
+        if price_info['count'] == 0:
+            print("skip {} (no price)".format(csv_name))
+            continue
+        maker, model, _, condition = parse_csv_name(csv_name, makers)
+        car_infos.append(dict(zip(('maker', 'model', 'condition'),
+                                  (item.upper() for item in (maker, model, condition)))))
+        price_infos.append(price_info)
+    return car_infos, price_infos
+
+
+def main():
+    """render report of all csv files in a directory"""
+    if len(sys.argv) not in (4, 5, 6):
+        print(
+            "Usage: >> python {} <csv_dir> <output_dir> <json or keyfile> [png or svg] [maker, condition or all]".format(
+                sys.argv[0]))
+        sys.exit(1)
+    csv_dir, output_dir = sys.argv[1], sys.argv[2]
+    fmt = sys.argv[4] if len(sys.argv) > 4 else 'png'
+    group_by = sys.argv[5] if len(sys.argv) > 5 else 'maker'
+    if fmt not in ('png', 'svg') or group_by not in ('maker', 'condition', 'all'):
+        print("unsupport format {} or group {}".format(fmt, group_by))
+        sys.exit(1)
+    if group_by == 'all':
+        group_by = None
+    makers = [maker['nm'].lower() for maker in load_car_catalog(sys.argv[3])]
+    car_infos, price_infos = load_price_infos(csv_dir, makers)
+    rendered, skipped = render_report(car_infos, price_infos, output_dir,
+                                      group_by, fmt=fmt)
+    print("render {:d} charts, skip {:d} unchanged charts in {}".format(
+        len(rendered), len(skipped), output_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang
+##################################
+"""
+re-parse archived raw pages
+"""
+
+from cars_com_crawling import reparse_archive
+
+
+if __name__ == "__main__":
+    reparse_archive()
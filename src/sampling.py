@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang, Jieru Hu
+##################################
+"""
+This module estimates price statistics from a sample of result
+pages instead of crawling every page
+
+Results are sorted by price and pages are drawn stratified (one
+random page of every block of pages per round, so cheap and
+expensive parts of the result list are both covered) until the
+bootstrap confidence intervals of mean and median are narrow
+enough. Precision is only checked after a full round, when every
+stratum has the same number of sampled pages. Listings are weighted
+by the size of their stratum and pages, the sampling units, are
+resampled within their stratum.
+"""
+
+# standard library
+import os
+import sys
+
+# third party library
+import numpy as np
+
+# local library
+from crawl_manifest import load_manifest, compile_job
+from cars_com_crawling import populate_urls, fetch_page, parse_page, sort_value
+from utility import extract_info_from_csvfilename
+from data_analysis import print_price_info, plot_price_info
+
+NUM_BOOTSTRAP = 500
+MIN_STRATUM_PAGES = 3   # sampled pages of a stratum before its variance is trusted
+
+
+def stratified_rounds(num_pages, num_strata, rng):
+    """
+    order in which pages are fetched, strata are blocks of consecutive
+    pages and every round takes one random page of every stratum
+
+    Args:
+        num_pages: number of result pages
+        num_strata: number of strata
+        rng: numpy RandomState
+
+    Returns:
+        (rounds, stratum_sizes): rounds is a list of lists of
+        (page index, stratum index)
+    """
+    blocks = np.array_split(np.arange(num_pages), min(num_strata, num_pages))
+    strata = [rng.permutation(block) for block in blocks]
+    rounds = []
+    for i in range(max(len(block) for block in strata)):
+        rounds.append([(int(block[i]), h) for h, block in enumerate(strata)
+                       if i < len(block)])
+    return rounds, [len(block) for block in blocks]
+
+
+def weighted_quantiles(values, weights, qs):
+    """
+    quantiles of sorted values for every row of weights
+
+    Args:
+        values: (n,) sorted values
+        weights: (b, n) weights
+        qs: list of quantiles
+
+    Returns:
+        (b, len(qs)) array
+    """
+    cum = np.cumsum(weights, axis=1)
+    total = cum[:, -1:]
+    result = np.empty((weights.shape[0], len(qs)))
+    for j, q in enumerate(qs):
+        result[:, j] = values[np.argmax(cum >= q * total, axis=1)]
+    return result
+
+
+def bootstrap_price_info(page_prices, page_strata, stratum_sizes,
+                         confidence=0.95, rng=None):
+    """
+    stratified estimates and confidence intervals, pages are
+    resampled within their stratum
+
+    A listing is weighted by the number of pages of its stratum per
+    sampled page of that stratum, so every stratum counts by its size
+    no matter how many of its pages have been fetched.
+
+    Args:
+        page_prices: list of price arrays, one per sampled page
+        page_strata: stratum index of every sampled page
+        stratum_sizes: number of pages of every stratum
+        confidence: confidence level
+        rng: numpy RandomState
+
+    Returns:
+        price_info: a dictionary, with mean_ci, median_ci, 25%_ci, 75%_ci
+        (infinite until every stratum not fully fetched has
+        MIN_STRATUM_PAGES pages)
+    """
+    if rng is None:
+        rng = np.random.RandomState()
+    page_strata = np.asarray(page_strata)
+    sizes = np.asarray(stratum_sizes)
+    sampled = np.bincount(page_strata, minlength=len(sizes))
+    page_weight = sizes[page_strata] / sampled[page_strata]
+    prices = np.concatenate(page_prices)
+    page_of = np.repeat(np.arange(len(page_prices)), [len(p) for p in page_prices])
+    order = np.argsort(prices)
+    prices, page_of = prices[order], page_of[order]
+    weights = page_weight[page_of]
+    mean = np.average(prices, weights=weights)
+    price_info = {'count': len(prices), 'mean': mean,
+                  'std': np.sqrt(np.average((prices - mean) ** 2, weights=weights)),
+                  'min': prices[0], 'max': prices[-1],
+                  'pages': len(page_prices), 'total_pages': int(sizes.sum())}
+    qs = [0.25, 0.5, 0.75]
+    names = ('25%', '50%', '75%')
+    for name, value in zip(names, weighted_quantiles(prices, weights[None, :], qs)[0]):
+        price_info[name] = value
+    price_info['median'] = price_info['50%']
+    incomplete = np.flatnonzero(sampled < sizes)
+    if len(incomplete) == 0 or (sampled[incomplete] < MIN_STRATUM_PAGES).any():
+        # all pages fetched (no sampling error) or too few to tell
+        width = 0.0 if len(incomplete) == 0 else np.inf
+        for name in ('mean',) + names:
+            price_info[name + '_ci'] = (price_info[name] - width, price_info[name] + width)
+    else:
+        # rescaled bootstrap (Rao and Wu): draw n - 1 of the n pages of
+        # every stratum with replacement, so that few pages per stratum
+        # do not shrink the variance. Fully fetched strata have no
+        # sampling error and keep their weights
+        boot_weight = np.tile(page_weight, (NUM_BOOTSTRAP, 1))
+        for h in incomplete:
+            pages = np.flatnonzero(page_strata == h)
+            n = len(pages)
+            counts = rng.multinomial(n - 1, np.full(n, 1.0 / n), size=NUM_BOOTSTRAP)
+            boot_weight[:, pages] = counts * (n / (n - 1)) * page_weight[pages]
+        weights = boot_weight[:, page_of]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = (weights * prices).sum(axis=1) / weights.sum(axis=1)
+        alpha = (1 - confidence) / 2
+        price_info['mean_ci'] = tuple(np.nanquantile(means, [alpha, 1 - alpha]))
+        # quantiles (Woodruff): interval of the fraction of listings below
+        # the estimate, mapped back through the estimated distribution
+        point_weights = page_weight[page_of][None, :]
+        for q, name in zip(qs, names):
+            below = prices <= price_info[name]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fractions = (weights * below).sum(axis=1) / weights.sum(axis=1)
+            low, high = np.nanquantile(fractions, [alpha, 1 - alpha])
+            half = (high - low) / 2
+            bounds = [min(max(q - half, 0.0), 1.0), min(max(q + half, 0.0), 1.0)]
+            price_info[name + '_ci'] = tuple(
+                weighted_quantiles(prices, point_weights, bounds)[0])
+    price_info['median_ci'] = price_info['50%_ci']
+    return price_info
+
+
+def sample_price_info(start_url, precision=0.02, confidence=0.95,
+                      num_strata=8, seed=None, filters=()):
+    """
+    fetch random pages round by round (one page of every stratum)
+    until mean and median confidence intervals are within precision
+    (relative half width), precision is checked only after complete
+    rounds so that every stratum is equally represented
+
+    Args:
+        start_url: start url, sorted by price so that the strata
+                   reduce variance
+        precision: target relative half width, e.g. 0.02 is +-2%
+        confidence: confidence level
+        num_strata: number of strata of result pages
+        seed: random seed
+        filters: e.g. (('price', (20000, 30000)), ('distance', (0, 50)))
+
+    Returns:
+        price_info: a dictionary, see bootstrap_price_info()
+    """
+    rng = np.random.RandomState(seed)
+    url_list = populate_urls(start_url)
+    rounds, stratum_sizes = stratified_rounds(len(url_list), num_strata, rng)
+    page_prices = []
+    page_strata = []
+    price_info = None
+    for pages in rounds:
+        for page, stratum in pages:
+            rows = parse_page(fetch_page(url_list[page]))
+            rows = [row for row in rows if all(
+                sort_value(row, key) is not None and low <= sort_value(row, key) <= high
+                for key, (low, high) in filters)]
+            prices = np.array([sort_value(row, 'price') for row in rows], dtype=float)
+            # pages without prices are kept, they are part of the sample
+            page_prices.append(prices[np.isfinite(prices) & (prices > 0)])
+            page_strata.append(stratum)
+        if not any(len(prices) for prices in page_prices):
+            continue
+        price_info = bootstrap_price_info(page_prices, page_strata, stratum_sizes,
+                                          confidence, rng)
+        half_widths = [(price_info[name + '_ci'][1] - price_info[name + '_ci'][0]) / 2 /
+                       price_info[name] for name in ('mean', 'median')]
+        if max(half_widths) <= precision:
+            break
+    return price_info
+
+
+def sample_and_compare():
+    """
+    estimate prices of multiple models from sampled pages and compare
+    """
+    if len(sys.argv) not in (6, 7):
+        print(
+            "Usage: >> python {} <maker_model_file> <zip> <radius> <used or new> <json or keyfile> [precision]".format(
+                sys.argv[0]))
+        print(
+            "e.g. python {} <maker_model_file> 53715 25 used <json or keyfile> 0.02".format(sys.argv[0]))
+        sys.exit(1)
+    defaults = {'zip': int(sys.argv[2]),
+                'radius': int(sys.argv[3]),
+                'condition': sys.argv[4]}
+    precision = float(sys.argv[6]) if len(sys.argv) == 7 else 0.02
+    entries, errors = load_manifest(sys.argv[1], defaults)
+    # strata of a price sorted list have different price levels
+    tasks, compile_errors = compile_job(entries, sys.argv[5], '', sort='price-lowest')
+    errors += compile_errors
+    if errors:
+        print("{:d} error(s) in {}:".format(len(errors), sys.argv[1]))
+        for error in errors:
+            print("  " + error)
+        sys.exit(1)
+    car_infos = []
+    price_infos = []
+    for task, entry in ((task, entry) for task in tasks for entry in task.entries):
+        # the helper strips the extension only from paths
+        car_info = extract_info_from_csvfilename(os.path.join('.', task.csv_name))
+        price_info = sample_price_info(task.url, precision, filters=entry.filters)
+        if price_info is None:
+            print("no price for {}".format(task.csv_name))
+            continue
+        print_price_info(price_info, car_info)
+        print("sampled {:d} of {:d} pages, {:.0%} confidence intervals".format(
+            price_info['pages'], price_info['total_pages'], 0.95))
+        for name in ('mean', 'median'):
+            low, high = price_info[name + '_ci']
+            print("{:s} = $ {:,.2f} - $ {:,.2f}".format(
+                (name + ' CI').ljust(len('median price')), low, high))
+        car_infos.append(car_info)
+        price_infos.append(price_info)
+    plot_price_info(car_infos, price_infos)
+
+
+if __name__ == "__main__":
+    sample_and_compare()
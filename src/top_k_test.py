@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+##################################
+# University of Wisconsin-Madison
+# Author: Yaqi Zhang
+##################################
+"""
+top k query example
+"""
+
+from cars_com_crawling import topk_carscom
+
+
+if __name__ == "__main__":
+    topk_carscom()
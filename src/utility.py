@@ -36,6 +36,29 @@ def extract_info_from_csvfilename(csv_name):
     return car_info
 
 
+def parse_csv_name(csv_name, makers):
+    """
+    split a crawled csv filename into its search
+
+    Args:
+        csv_name: e.g. data/Mercedes-Benz-C-Class-53715-100-used.csv
+        makers: lower case maker names of the catalog, makers with
+                a hyphen (e.g. mercedes-benz) are matched first
+
+    Returns:
+        (maker, model, zipcode, condition)
+    """
+    name = os.path.splitext(os.path.basename(csv_name))[0]
+    maker_model, zipcode, _, condition = name.rsplit('-', 3)
+    for maker in sorted(makers, key=len, reverse=True):
+        if maker_model.lower().startswith(maker + '-'):
+            return (maker_model[:len(maker)], maker_model[len(maker) + 1:],
+                    zipcode, condition)
+    # maker aliases (e.g. benz) have no hyphen
+    maker, model = maker_model.split('-', 1)
+    return maker, model, zipcode, condition
+
+
 def user_input():
     """
     parse command line args